@@ -1,22 +1,35 @@
+import collections
 import datetime
+import itertools
 import requests
+from requests.adapters import HTTPAdapter
 import sys
-import json
 import time
-from jsonschema import validate, ValidationError
-
+from concurrent.futures import ThreadPoolExecutor
+from jsonschema import ValidationError
+from jsonschema.validators import validator_for
+
+from filters import Filters
+from json_backend import Json
+from progress import Progress
+from ratelimit import RateLimiter
+from response_cache import ResponseCache
 from switches import Switches
 
 class Api:
     # region Constants
+    URL_CONV_INFO = "https://slack.com/api/conversations.info"
     URL_CONV_LIST = "https://slack.com/api/conversations.list"
     URL_FILE_LIST = "https://slack.com/api/files.list"
     URL_HISTORY_CONV = "https://slack.com/api/conversations.history"
+    URL_REPLIES = "https://slack.com/api/conversations.replies"
+    URL_USER_INFO = "https://slack.com/api/users.info"
     URL_USER_LIST = "https://slack.com/api/users.list"
 
     REQUEST_COUNT_CONV = 0
     REQUEST_COUNT_HISTORY = 500
-    REQUEST_COUNT_FILES = 100
+    REQUEST_COUNT_REPLIES = 1000
+    REQUEST_COUNT_FILES = 1000  # Slack caps this if it's too high, and the paging in the response reflects that
     REQUEST_COUNT_USERS = 0
 
     # Number of times to retry and wait times (in seconds)
@@ -25,6 +38,9 @@ class Api:
     WAIT_TIME_TIER_3 = 3
     WAIT_TIME_TIER_4 = 1
 
+    # Number of pages of the file list to retrieve at once
+    FILE_LIST_WORKERS = 4
+
     # region Schemas
     SCHEMA_FILE_LIST = {
         "$schema": "http://json-schema.org/draft-04/schema#",
@@ -142,6 +158,26 @@ class Api:
         },
         "required": ["members"]
     }
+    SCHEMA_USER_INFO = {
+        "type": "object",
+        "properties": {
+            "user": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "profile": {
+                        "type": "object",
+                        "properties": {
+                            "display_name": {"type": "string"}
+                        },
+                        "required": ["display_name"]
+                    }
+                },
+                "required": ["id", "profile"]
+            }
+        },
+        "required": ["user"]
+    }
     SCHEMA_CONV_LIST = {
         "type": "object",
         "properties": {
@@ -172,118 +208,272 @@ class Api:
             "channels"
         ]
     }
+    SCHEMA_CONV_INFO = {
+        "type": "object",
+        "properties": {
+            "channel": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "string"},
+                    "name": {"type": "string"},
+                    "is_im": {"type": "boolean"}
+                },
+                "required": ["id"]
+            }
+        },
+        "required": ["channel"]
+    }
     # endregion
     # endregion
 
     token = None
 
+    # Reused for every request so that connections stay open between requests (and between runs of a daemon)
+    session = requests.Session()
+    __validators = {}
+
+    # Connections kept open for API requests made at once (the file list, prefetching mappings and thread backfills)
+    POOL_SIZE_API = 16
+    __pool_size = 0
+
+    # The default pool only keeps 10 connections, any more are thrown away and reconnected for every request
+    # Downloads share the session, so the pool needs to be large enough for those as well
+    @classmethod
+    def size_pool(cls, download_connections: int):
+        size = cls.POOL_SIZE_API + download_connections
+        if size <= cls.__pool_size:
+            return
+
+        adapter = HTTPAdapter(pool_maxsize=size)
+        cls.session.mount("https://", adapter)
+        cls.session.mount("http://", adapter)
+        cls.__pool_size = size
+
     @classmethod
     def get_profiles(cls, cursor=None):
         params = {'limit': cls.REQUEST_COUNT_USERS}
         if cursor is not None:
             params['cursor'] = cursor
 
-        response = cls.get_request(cls.URL_USER_LIST, params, schema=cls.SCHEMA_USER_LIST, timeout=cls.WAIT_TIME_TIER_2)
+        response = cls.get_request(cls.URL_USER_LIST, params, schema=cls.SCHEMA_USER_LIST, timeout=cls.WAIT_TIME_TIER_2,
+                                   tier=2)
         return response['members'], cls.get_cursor(response)
 
+    # Returns None if the user doesn't exist
+    @classmethod
+    def get_user_info(cls, user_id: str):
+        params = {'user': user_id}
+
+        response = cls.get_request(cls.URL_USER_INFO, params, schema=cls.SCHEMA_USER_INFO, timeout=cls.WAIT_TIME_TIER_4,
+                                   tier=4, ok_errors=('user_not_found', 'user_not_visible'))
+        if not response['ok']:
+            return None
+        return response['user']
+
     @classmethod
     def get_conversations(cls, cursor=None):
         params = {'limit': cls.REQUEST_COUNT_CONV}
         if cursor is not None:
             params['cursor'] = cursor
 
-        response = cls.get_request(cls.URL_CONV_LIST, params, schema=cls.SCHEMA_CONV_LIST, timeout=cls.WAIT_TIME_TIER_2)
+        response = cls.get_request(cls.URL_CONV_LIST, params, schema=cls.SCHEMA_CONV_LIST, timeout=cls.WAIT_TIME_TIER_2,
+                                   tier=2)
         return response['channels'], cls.get_cursor(response)
 
+    # Returns None if the conversation doesn't exist or isn't visible to the token
     @classmethod
-    def get_conv_history(cls, conv, start_time: datetime, end_time: datetime):
-        print("Retrieving messages between " + cls.format_time(start_time) + " - " + cls.format_time(end_time))
+    def get_conversation_info(cls, conv_id: str):
+        params = {'channel': conv_id}
 
-        params = {
-            'channel': conv,
-            'inclusive': True,
-            'oldest': start_time.timestamp(),
-            'latest': end_time.timestamp(),
-        }
+        response = cls.get_request(cls.URL_CONV_INFO, params, schema=cls.SCHEMA_CONV_INFO, timeout=cls.WAIT_TIME_TIER_3,
+                                   tier=3, ok_errors=('channel_not_found', 'missing_scope'))
+        if not response['ok']:
+            return None
 
-        print(f"Querying slack for messages between {params['oldest']} - {params['latest']}")
+        channel = response['channel']
+        channel.setdefault('is_im', False)
+        return channel
+
+    # Messages are added to the buffer if one is given (e.g. a MessageBuffer), otherwise they're returned in a list
+    @classmethod
+    def get_conv_history(cls, conv, start_time: datetime, end_time: datetime, checkpoint=None, buffer=None):
+        Progress.info("Retrieving messages between " + cls.format_time(start_time) + " - " + cls.format_time(end_time))
+        params = cls.get_history_params(conv, start_time, end_time)
 
         # Build up array repeatedly
-        messages = []
+        messages = buffer if buffer is not None else []
+
+        # Carry on from where a previous run stopped
+        if checkpoint is not None:
+            _, cursor, complete = checkpoint.load(messages)
+            if complete:
+                Progress.info(f"Loaded {len(messages)} messages from checkpoint '{checkpoint.loc}'")
+                return messages
+            if cursor is not None:
+                Progress.info(f"Resuming from checkpoint '{checkpoint.loc}' with {len(messages)} messages")
+                params['cursor'] = cursor
+
+        Progress.info(f"Querying slack for messages between {params['oldest']} - {params['latest']}")
+
+        Progress.start("history", "messages")
+        Progress.update("history", len(messages))
         while True:
             # Get next batch of messages
-            content = cls.get_request(cls.URL_HISTORY_CONV, params, schema=cls.SCHEMA_HISTORY_DM, timeout=cls.WAIT_TIME_TIER_4)
+            content = cls.get_history_page(params)
 
-            next_messages = content['messages']
-            if len(next_messages) == 0:
-                break
+            # Filter before storing anything, if the overlapping message was filtered out then it will be again
+            next_messages = Filters.filter_messages(content['messages'])
 
             # Make sure first/last messages don't overlap
-            if len(messages) > 0 and next_messages[0]['ts'] == messages[-1]['ts']:
-                messages.extend(next_messages[1:])
-            else:
-                messages.extend(next_messages)
+            if len(messages) > 0 and len(next_messages) > 0 and next_messages[0]['ts'] == messages[-1]['ts']:
+                next_messages = next_messages[1:]
+            messages.extend(next_messages)
+            Progress.update("history", len(next_messages))
 
             # Update params and print status if there are more messages to get
-            if not content['has_more']:
-                print("Retrieved " + str(len(messages)) + " messages")
+            cursor = None
+            if content['has_more'] and len(content['messages']) > 0:
+                cursor = content['response_metadata']['next_cursor']
+
+            if checkpoint is not None:
+                checkpoint.append(next_messages, cursor)
+
+            if cursor is None:
                 break
 
-            print("Messages retrieved so far: " + str(len(messages)))
-            params['cursor'] = content['response_metadata']['next_cursor']
+            params['cursor'] = cursor
+
+        Progress.finish("history")
 
         return messages
 
     @classmethod
-    def get_file_list(cls, channel, start_time: datetime, end_time: datetime):
-        page = 1
+    def get_history_params(cls, conv, start_time: datetime, end_time: datetime):
+        return {
+            'channel': conv,
+            'inclusive': True,
+            'oldest': start_time.timestamp(),
+            'latest': end_time.timestamp(),
+        }
+
+    @classmethod
+    def get_history_page(cls, params: dict):
+        return cls.get_request(cls.URL_HISTORY_CONV, params, schema=cls.SCHEMA_HISTORY_DM, timeout=cls.WAIT_TIME_TIER_4,
+                               tier=4)
+
+    # Returns every message in the thread, including the parent
+    @classmethod
+    def get_replies(cls, conv, thread_ts: str):
         params = {
-            'count': cls.REQUEST_COUNT_FILES,
-            'channel': channel,
-            'ts_from': start_time.timestamp(),
-            'ts_to': end_time.timestamp()
+            'channel': conv,
+            'ts': thread_ts,
+            'limit': cls.REQUEST_COUNT_REPLIES
         }
 
-        num_files = 0
-        file_list = []
+        messages = []
         while True:
-            # Get next page of files
-            params['page'] = page
-            print(f"Querying slack for page {page} of ALL files between {params['ts_from']} - {params['ts_to']}")
-            response = cls.get_request(cls.URL_FILE_LIST, params, cls.SCHEMA_FILE_LIST)
+            # Replies have the same format as the history
+            content = cls.get_request(cls.URL_REPLIES, params, schema=cls.SCHEMA_HISTORY_DM, timeout=cls.WAIT_TIME_TIER_3,
+                                      tier=3)
+            messages.extend(content['messages'])
+
+            cursor = cls.get_cursor(content)
+            if not content['has_more'] or cursor is None:
+                return messages
+            params['cursor'] = cursor
 
-            num_files += len(response['files'])
-            tot_files = response['paging']['total']
-            print(f"Retrieved data about {num_files}/{tot_files} files")
+    @classmethod
+    def get_file_list(cls, channel, start_time: datetime, end_time: datetime, page_callback=None):
+        params = cls.get_file_list_params(channel, start_time, end_time)
 
-            # Add files to list
-            for file in response['files']:
-                file_list.append(file)
+        # The first page tells us how many pages there are, so the rest can be retrieved concurrently
+        Progress.info(f"Querying slack for ALL files between {params['ts_from']} - {params['ts_to']}")
+        response = cls.get_file_page(params, 1)
+        num_pages = response['paging']['pages']
+        Progress.start("file list", "files", total=response['paging']['total'])
 
-            # Decide whether to continue or not
-            if num_files == 0 or response['paging']['page'] >= response['paging']['pages']:
-                break
-            page += 1
+        file_list = []
+        with ThreadPoolExecutor(max_workers=cls.FILE_LIST_WORKERS) as executor:
+            pages = range(2, num_pages + 1) if len(response['files']) > 0 else []
+            responses = itertools.chain([response], cls.iter_file_pages(executor, params, pages))
+
+            for response in responses:
+                Progress.update("file list", len(response['files']))
+
+                # Add files to list
+                files = Filters.filter_files(response['files'])
+                file_list.extend(files)
 
+                # Hand the page on straight away if something is consuming the list as it is built
+                if page_callback is not None and len(files) > 0:
+                    page_callback(files)
+
+        Progress.finish("file list")
         return file_list
 
+    # Yields the pages in order, only requesting up to FILE_LIST_WORKERS pages ahead of the one being consumed
+    # so that pages don't pile up in memory when the consumer (e.g. the download queue) is slower
+    @classmethod
+    def iter_file_pages(cls, executor: ThreadPoolExecutor, params: dict, pages):
+        pages = iter(pages)
+        futures = collections.deque(executor.submit(cls.get_file_page, params, page)
+                                    for page in itertools.islice(pages, cls.FILE_LIST_WORKERS))
+        while len(futures) > 0:
+            response = futures.popleft().result()
+            for page in itertools.islice(pages, 1):
+                futures.append(executor.submit(cls.get_file_page, params, page))
+            yield response
+
+    @classmethod
+    def get_file_list_params(cls, channel, start_time: datetime, end_time: datetime):
+        return {
+            'count': cls.REQUEST_COUNT_FILES,
+            'channel': channel,
+            'ts_from': start_time.timestamp(),
+            'ts_to': end_time.timestamp()
+        }
+
+    @classmethod
+    def get_file_page(cls, params: dict, page: int):
+        params = dict(params, page=page)
+        return cls.get_request(cls.URL_FILE_LIST, params, cls.SCHEMA_FILE_LIST, timeout=cls.WAIT_TIME_TIER_3, tier=3)
+
     # GET requests all have the same processing logic
     # Also remove requirement to send token for everything
+    # If a tier is given then the request waits for the rate limiter, which is needed when requests are made concurrently
+    # (or from several processes), and 429s push back every request for that tier rather than just this one
+    # Errors in ok_errors are expected, and the response is returned as is for the caller to check
     @classmethod
-    def get_request(cls, url: str, params: dict, schema: dict = None, timeout: int = 5):
-        num_tries = 0
+    def get_request(cls, url: str, params: dict, schema: dict = None, timeout: int = 5, tier: int = None,
+                    ok_errors: tuple = ()):
+        # Cached responses skip the rate limiter entirely
+        cached = ResponseCache.lookup(url, params)
+        if cached is not None:
+            resp_json = cls.check_response(url, Json.loads(cached), schema, ok_errors)
+            if resp_json is not False:
+                return resp_json
+        if ResponseCache.enabled() and ResponseCache.mode == Switches.CacheModes.REPLAY:
+            print(f"No usable cached response for URL: {url} (replaying cache only)")
+            sys.exit(-1)
 
+        num_tries = 0
         while num_tries < cls.TIMEOUT_RETRIES:
             if num_tries > 0:
                 print(f"Retrying... (attempt {num_tries + 1})")
-            attempt = cls.get_request_once(url, params, schema)
+            if tier is not None:
+                RateLimiter.acquire(RateLimiter.get_method(url), tier)
+            attempt = cls.get_request_once(url, params, schema, ok_errors)
             num_tries += 1
 
             if attempt is False:
                 continue
             if attempt is True:
                 print(f"Waiting for {timeout} second(s)")
-                time.sleep(timeout)
+                if tier is not None:
+                    # The wait happens when the next slot is acquired
+                    RateLimiter.back_off(RateLimiter.get_method(url), timeout)
+                else:
+                    time.sleep(timeout)
                 continue
 
             return attempt
@@ -294,31 +484,43 @@ class Api:
     # Returns False for error
     # Returns True for error with 429 code
     @classmethod
-    def get_request_once(cls, url: str, params: dict, schema: dict = None):
+    def get_request_once(cls, url: str, params: dict, schema: dict = None, ok_errors: tuple = ()):
         error_msg = f"Exception with request for URL: {url}"
         response = cls.request_base(url, params)
         if not isinstance(response, requests.Response):
             return response
 
-        if response.text is None:
+        if response.content is None:
             print(error_msg)
             print("Response is null")
             return False
 
-        resp_json = json.loads(response.text)
+        resp_json = cls.check_response(url, Json.loads(response.content), schema, ok_errors)
+        if resp_json is not False:
+            ResponseCache.store(url, params, response.content)
+
+        return resp_json
+
+    # Checks the decoded JSON of a response, returning False if it isn't usable
+    @classmethod
+    def check_response(cls, url: str, resp_json: dict, schema: dict = None, ok_errors: tuple = ()):
+        error_msg = f"Exception with request for URL: {url}"
         if 'ok' not in resp_json or ('ok' not in resp_json and 'error' not in resp_json):
             print(error_msg)
             print("Returned JSON was not in the correct format:")
-            print(json.dumps(resp_json, indent=4))
+            print(Json.dumps(resp_json, indent=4))
             return False
 
         if not resp_json['ok']:
+            if resp_json.get('error') in ok_errors:
+                return resp_json
+
             print(error_msg)
             print("Response gave 'false' signal for ok. Error provided: " + resp_json['error'])
 
         if schema is not None:
             try:
-                validate(resp_json, schema)
+                cls.get_validator(schema).validate(resp_json)
             except ValidationError as e:
                 print(error_msg)
                 print(e)
@@ -336,7 +538,7 @@ class Api:
         # Go through obvious failure points
         # noinspection PyBroadException
         try:
-            response = requests.get(url, params)
+            response = cls.session.get(url, params=params)
         except requests.exceptions.RequestException as e:
             print(error_msg)
             print(e)
@@ -354,6 +556,17 @@ class Api:
 
         return response
 
+    # Building a validator checks the schema itself, so only do it once per schema rather than for every response
+    @classmethod
+    def get_validator(cls, schema: dict):
+        key = id(schema)
+        if key not in cls.__validators:
+            validator_cls = validator_for(schema)
+            validator_cls.check_schema(schema)
+            cls.__validators[key] = validator_cls(schema)
+
+        return cls.__validators[key]
+
     @classmethod
     def get_cursor(cls, data: dict):
         if 'response_metadata' not in data:
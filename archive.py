@@ -0,0 +1,328 @@
+import argparse
+import datetime
+import os.path
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from api import Api
+from checkpoint import Checkpoint
+from files import Files
+from history_buffer import MessageBuffer
+from manifest import Manifest
+from partitions import Partitioner
+from progress import Progress
+from resolvers import ConversationMap, UserMap
+from slack import Slack
+from status import Status
+from switches import Switches
+from threads import ThreadBackfill
+from writers import JsonWriter, TextWriter
+
+# Archives a single conversation, this is what archiver.py runs and can be used directly as a library
+# The options are the same as the command line arguments of archiver.py
+# User and conversation maps can be passed in so that they stay warm across runs (e.g. when running as a daemon)
+class Archiver:
+    # Pages of the file list are handed from the listing thread to the download thread through a bounded queue
+    # This stops the listing from running too far ahead of the downloads, while still keeping the downloader busy
+    PIPELINE_QUEUE_SIZE = 4
+    PIPELINE_END = None
+
+    def __init__(self, args: argparse.Namespace, start_time: datetime, end_time: datetime,
+                 user_map: dict = None, conversation_map: dict = None):
+        self.args = args
+        self.start_time = start_time
+        self.end_time = end_time
+        self.user_map = user_map
+        self.conversation_map = conversation_map
+        self.thread_msgs = None
+        self.manifest = None
+
+        # Large files are downloaded over several connections each
+        Api.size_pool(args.file_workers * Files.RANGE_CONNECTIONS)
+
+    def run(self):
+        if self.args.pipeline:
+            self.run_pipelined()
+        else:
+            self.run_sequential()
+
+        # Only throw away the checkpoint once everything has been exported
+        if self.args.checkpoint is not None and Status.num_errors() == 0:
+            self.get_checkpoint().remove()
+
+    def get_user_map(self):
+        Progress.info("Retrieving user mappings")
+        user_id_map = {}
+
+        # Make requests until response_metadata has no cursor
+        cursor = None
+        while True:
+            profiles, cursor = Api.get_profiles(cursor)
+
+            for profile in profiles:
+                user_id_map[profile['id']] = profile['profile']['display_name']
+
+            if cursor is None:
+                break
+
+        return user_id_map
+
+    # Unless crawling, only looks up the users referenced by the messages
+    # Anyone else (e.g. file uploaders) is looked up when needed
+    # The map is kept, so the next run with this archiver only has to look up users it hasn't seen
+    def resolve_user_map(self, messages):
+        if self.user_map is None:
+            self.user_map = self.get_user_map() if self.args.crawl_users else UserMap()
+
+        self.prefetch_users(self.user_map, messages)
+        return self.user_map
+
+    def prefetch_users(self, user_map: dict, items):
+        if isinstance(user_map, UserMap):
+            user_map.prefetch(UserMap.collect_ids(items))
+
+    # Unless crawling, only looks up the channels that are mentioned in the messages
+    def resolve_conversation_map(self, messages):
+        if self.conversation_map is None:
+            self.conversation_map = self.get_conversation_map() if self.args.crawl_conversations else ConversationMap()
+
+        if isinstance(self.conversation_map, ConversationMap):
+            self.conversation_map.prefetch(ConversationMap.collect_ids(messages))
+        return self.conversation_map
+
+    def get_conversation_map(self):
+        Progress.info("Retrieving conversation mappings")
+        conv_id_map = {}
+
+        # Make requests until response_metadata has no cursor
+        cursor = None
+        while True:
+            conversations, cursor = Api.get_conversations(cursor)
+
+            for conv in conversations:
+                name = conv['name']
+                if conv['is_im']:
+                    name = "@" + name
+                else:
+                    name = "#" + name
+
+                conv_id_map[conv['id']] = name
+
+            if cursor is None:
+                break
+
+        return conv_id_map
+
+    def open_writer(self, writer_cls, file: str, compression, **kwargs):
+        loc = os.path.join(self.args.output, file)
+        return writer_cls(loc, compression, Switches.rotate_size, Switches.rotate_period, **kwargs)
+
+    def download_files(self, file_list, user_map: dict):
+        # Old method using scraping
+        # files = Files.get_files(messages)
+        if len(file_list) == 0:
+            return
+
+        # Download files
+        Progress.info("")
+        Progress.start("downloads", "files", total=len(file_list), total_bytes=sum(file['size'] for file in file_list))
+        self.manifest = Manifest(self.args.files)
+        try:
+            self.download_batch(file_list, user_map)
+        finally:
+            self.manifest.save()
+        Progress.finish("downloads")
+
+        self.print_download_summary()
+
+    def download_batch(self, file_list, user_map: dict):
+        self.prefetch_users(user_map, file_list)
+
+        if self.args.file_workers == 1:
+            for file in file_list:
+                self.download_file(file, user_map)
+            return
+
+        # Start the largest files first so the small ones are downloaded around them,
+        # rather than a large file at the end holding everything up
+        file_list = sorted(file_list, key=lambda file: file['size'], reverse=True)
+        with ThreadPoolExecutor(max_workers=self.args.file_workers) as executor:
+            list(executor.map(lambda file: self.download_file(file, user_map), file_list))
+
+    def download_file(self, file, user_map: dict):
+        success = Files.download_file(self.args.token, file, self.args.files, user_map, overwrite=self.args.files_overwrite,
+                                      manifest=self.manifest)
+
+        with Status.lock:
+            if success:
+                Status.tot_files += 1
+            else:
+                Status.file_failures += 1
+
+    def print_download_summary(self):
+        # Status messages
+        Progress.info("File download complete")
+        if Status.files_already_exist == 0:
+            return
+        if self.args.files_overwrite:
+            Progress.info(f"{Status.files_already_exist} files were overwritten")
+        else:
+            Progress.info(f"{Status.files_already_exist} files were not downloaded as files with the same name already existed")
+
+    def export_json(self, messages):
+        Progress.info("Exporting raw json")
+
+        try:
+            with self.open_writer(JsonWriter, self.args.json, Switches.json_compression) as writer:
+                for msg in messages:
+                    writer.write_message(msg)
+                writer.close_or_empty()
+        except IOError as e:
+            print(e)
+            Status.export_json = True
+
+    def export_text(self, messages, slack: Slack):
+        Progress.info("Formatting and exporting text")
+
+        try:
+            with self.open_writer(TextWriter, self.args.text, Switches.text_compression,
+                                  index=Switches.text_index) as writer:
+                for msg, text in slack.iter_formatted(messages, thread_msgs=self.thread_msgs):
+                    writer.write_message(msg, text)
+                writer.close_or_empty()
+        except IOError as e:
+            print(e)
+            Status.export_text = True
+
+    def export_partitioned(self, messages, slack: Slack):
+        Progress.info("Exporting partitions")
+
+        try:
+            partitioner = Partitioner(Switches.partition, self.args.output, self.start_time, self.end_time)
+            partitioner.export(messages, self.args.json, self.args.text, slack, self.thread_msgs)
+        except IOError as e:
+            print(e)
+            Status.export_json = self.args.json is not None
+            Status.export_text = self.args.text is not None
+
+    def get_history(self):
+        checkpoint = self.get_checkpoint()
+
+        if self.args.memory_limit is None:
+            messages = Api.get_conv_history(self.args.dm, self.start_time, self.end_time, checkpoint)
+            messages.reverse()
+            return messages
+
+        # Spill to the output directory rather than the system temp directory, which is often much smaller
+        buffer = MessageBuffer(self.args.memory_limit, self.args.output or None)
+        Api.get_conv_history(self.args.dm, self.start_time, self.end_time, checkpoint, buffer)
+        return buffer.chronological()
+
+    # Retrieves any thread replies that weren't in the history, the results are used when formatting threads
+    def backfill_threads(self, messages, user_map: dict):
+        if not self.args.backfill_threads:
+            return
+
+        self.thread_msgs = ThreadBackfill(self.args.dm).backfill(messages)
+        self.prefetch_users(user_map, self.thread_msgs.values())
+
+    def get_checkpoint(self):
+        if self.args.checkpoint is None:
+            return None
+
+        return Checkpoint(self.args.checkpoint, self.args.dm, self.start_time.timestamp(), self.end_time.timestamp())
+
+    def run_sequential(self):
+        # Retrieve messages
+        messages = self.get_history()
+
+        # Get user map
+        Progress.info("")
+        user_map = self.resolve_user_map(messages)
+        conversation_map = self.resolve_conversation_map(messages)
+        self.backfill_threads(messages, user_map)
+        slack = Slack(user_map, conversation_map)
+
+        if Switches.partition is not None:
+            self.export_partitioned(messages, slack)
+        else:
+            if self.args.json is not None:
+                self.export_json(messages)
+            if self.args.text is not None:
+                self.export_text(messages, slack)
+
+        if self.args.files is not None:
+            Progress.info("\nRetrieving list of ALL files uploaded to slack")
+            files = Api.get_file_list(self.args.dm, self.start_time, self.end_time)
+            Progress.info(f"Found {len(files)} file(s) that were sent in {self.args.dm}")
+
+            self.download_files(files, user_map)
+
+    def list_files_pipelined(self, file_queue: queue.Queue):
+        try:
+            files = Api.get_file_list(self.args.dm, self.start_time, self.end_time, page_callback=file_queue.put)
+            Progress.info(f"Found {len(files)} file(s) that were sent in {self.args.dm}")
+        finally:
+            file_queue.put(self.PIPELINE_END)
+
+    def download_files_pipelined(self, file_queue: queue.Queue, user_map_future):
+        try:
+            # Folder names depend on usernames, so wait for the map before taking anything off the queue
+            user_map = user_map_future.result()
+            Progress.start("downloads", "files")
+            self.manifest = Manifest(self.args.files)
+
+            while True:
+                page = file_queue.get()
+                if page is self.PIPELINE_END:
+                    break
+
+                Progress.add_total("downloads", len(page), sum(file['size'] for file in page))
+                self.download_batch(page, user_map)
+                self.manifest.save()
+        except BaseException:
+            # Keep draining so that the listing thread doesn't block forever on a full queue
+            while file_queue.get() is not self.PIPELINE_END:
+                pass
+            raise
+
+        Progress.finish("downloads")
+        self.print_download_summary()
+
+    def run_pipelined(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            # Mappings and the file list don't depend on the history, so start them straight away
+            # Nothing to prefetch yet, lazy maps are populated as messages and files come in
+            user_map_future = executor.submit(self.resolve_user_map, [])
+            if self.args.crawl_conversations:
+                conversation_map_future = executor.submit(self.resolve_conversation_map, [])
+
+            file_futures = []
+            if self.args.files is not None:
+                file_queue = queue.Queue(maxsize=self.PIPELINE_QUEUE_SIZE)
+                file_futures.append(executor.submit(self.list_files_pipelined, file_queue))
+                file_futures.append(executor.submit(self.download_files_pipelined, file_queue, user_map_future))
+
+            # The exports are in chronological order but slack returns the newest messages first,
+            # so the writers can only start once the whole history has been retrieved
+            messages = self.get_history()
+            self.prefetch_users(user_map_future.result(), messages)
+            if not self.args.crawl_conversations:
+                conversation_map_future = executor.submit(self.resolve_conversation_map, messages)
+            self.backfill_threads(messages, user_map_future.result())
+
+            export_futures = []
+            if Switches.partition is not None:
+                # Partitions share an index, so they are written from a single thread
+                slack = Slack(user_map_future.result(), conversation_map_future.result())
+                export_futures.append(executor.submit(self.export_partitioned, messages, slack))
+            else:
+                if self.args.json is not None:
+                    export_futures.append(executor.submit(self.export_json, messages))
+                if self.args.text is not None:
+                    slack = Slack(user_map_future.result(), conversation_map_future.result())
+                    export_futures.append(executor.submit(self.export_text, messages, slack))
+
+            # Surface any exceptions raised by the worker threads
+            for future in export_futures + file_futures:
+                future.result()
@@ -1,11 +1,10 @@
 import argparse
-import os.path
-import json
-import sys
 
 from api import Api
-from files import Files
-from slack import Slack
+from ratelimit import RateLimiter
+from response_cache import ResponseCache
+from archive import Archiver
+from planner import Planner
 from status import Status
 from switches import Switches
 
@@ -32,131 +31,92 @@ def arg_setup():
                         help="Output the message history in raw json form")
     parser.add_argument('-t', '--text', nargs='?', const='dm.txt',
                         help="Output the message history in human readable form")
+    parser.add_argument('-ji', '--json-indent', type=int,
+                        help="Indent to use for the json output (default 4). An indent of 2 is faster if orjson is installed")
+    parser.add_argument('-jc', '--json-compression',
+                        help="Compression to use for the json output. Supported options: " + Switches.list_enum(Switches.Compression))
+    parser.add_argument('-tc', '--text-compression',
+                        help="Compression to use for the text output. Supported options: " + Switches.list_enum(Switches.Compression))
+    parser.add_argument('-tx', '--text-index', action='store_true',
+                        help="Save an index of the byte offset of every day and message next to the text output")
+    parser.add_argument('-rs', '--rotate-size',
+                        help="Start a new output file once the current one exceeds this size (uncompressed), e.g. 100MB")
+    parser.add_argument('-rp', '--rotate-period',
+                        help="Start a new output file for each period of messages. Supported options: " + Switches.list_enum(Switches.Periods))
+    parser.add_argument('-rw', '--refresh-window', type=int,
+                        help="Only retrieve the last N days and patch edits, deletions and new replies into the "
+                             "partitioned output")
+    parser.add_argument('-pt', '--partition',
+                        help="Write a directory of files per period plus an index, only rewriting periods that have changed. "
+                             "Requires json output. "
+                             "Supported options: " + Switches.list_enum(Switches.Periods))
 
     # File args
     parser.add_argument('-f', '--files', nargs='?', const='output_files',
                         help="Download files found in JSON to the directory")
     parser.add_argument('-fo', '--files-overwrite', action='store_true',
                         help="Overwrite files if they exist")
+    parser.add_argument('-fw', '--file-workers', type=int, default=1,
+                        help="Number of files to download at once. Large files are also split over several connections")
+
+    # Filter args
+    parser.add_argument('-fu', '--filter-user', action='append',
+                        help="Only keep messages and files from this user ID (can be given multiple times)")
+    parser.add_argument('-xs', '--exclude-subtype', action='append',
+                        help="Drop messages with this subtype (can be given multiple times). "
+                             "Use 'noise' for joins, leaves, topic changes etc.")
+    parser.add_argument('-xb', '--exclude-bots', action='store_true',
+                        help="Drop messages posted by bots")
+    parser.add_argument('-ft', '--file-type', action='append',
+                        help="Only download files of this type, e.g. pdf (can be given multiple times)")
+    parser.add_argument('-fm', '--file-max-size',
+                        help="Don't download files larger than this, e.g. 100MB")
+
+    # Thread args
+    parser.add_argument('-bt', '--backfill-threads', action='store_true',
+                        help="Retrieve thread replies that aren't in the retrieved history, so threads are complete")
+
+    # Mapping args
+    parser.add_argument('-cu', '--crawl-users', action='store_true',
+                        help="Retrieve every user in the workspace up front, instead of only the users referenced")
+    parser.add_argument('-cc', '--crawl-conversations', action='store_true',
+                        help="Retrieve every conversation up front, instead of only the channels mentioned")
+
+    # Execution args
+    parser.add_argument('-pg', '--progress',
+                        help="How to report progress. Supported options: " + Switches.list_enum(Switches.ProgressModes))
+    parser.add_argument('-ml', '--memory-limit', type=int,
+                        help="Maximum number of messages to hold in memory, any more are spilled to disk")
+    parser.add_argument('-cp', '--checkpoint', nargs='?', const='checkpoints',
+                        help="Save retrieved history to this directory as it arrives, so an interrupted run can resume")
+    parser.add_argument('-rd', '--rate-db',
+                        help="SQLite database to share rate limits through, for when several archivers use the same token")
+    parser.add_argument('-rc', '--response-cache', nargs='?', const='response_cache',
+                        help="Cache API responses in this directory, so repeated exports don't request the same data again")
+    parser.add_argument('-cm', '--cache-mode',
+                        help="How to use the response cache (default record). "
+                             "Supported options: " + Switches.list_enum(Switches.CacheModes))
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help="Overlap fetching, mapping, formatting and writing instead of running each stage in turn")
+    parser.add_argument('-pl', '--plan', action='store_true',
+                        help="Estimate the requests, time and disk space the export needs without doing it")
 
     # Process basic args
     parsed_args = parser.parse_args()
     Switches.set_switches(parsed_args, parser)
     Api.token = parsed_args.token
+    if parsed_args.rate_db is not None:
+        RateLimiter.use_database(parsed_args.rate_db, parsed_args.token)
+    if parsed_args.response_cache is not None:
+        ResponseCache.configure(parsed_args.response_cache, Switches.cache_mode)
 
     return parsed_args
 
-def get_user_map():
-    print("Retrieving user mappings")
-    user_id_map = {}
-
-    # Make requests until response_metadata has no cursor
-    cursor = None
-    while True:
-        profiles, cursor = Api.get_profiles(cursor)
-
-        for profile in profiles:
-            user_id_map[profile['id']] = profile['profile']['display_name']
-
-        if cursor is None:
-            break
-
-    return user_id_map
-
-def get_conversation_map():
-    print("Retrieving conversation mappings")
-    conv_id_map = {}
-
-    # Make requests until response_metadata has no cursor
-    cursor = None
-    while True:
-        conversations, cursor = Api.get_conversations(cursor)
-
-        for conv in conversations:
-            name = conv['name']
-            if conv['is_im']:
-                name = "@" + name
-            else:
-                name = "#" + name
-
-            conv_id_map[conv['id']] = name
-
-        if cursor is None:
-            break
-
-    return conv_id_map
-
-def write_to_file(file: str, data):
-    # Get full path and create directory if it doesn't exist
-    loc = os.path.join(args.output, file)
-    print(f"Saving data to {loc}")
-    Files.make_dirs(loc)
-
-    # Write to file and return true/false
-    try:
-        with open(loc, "w", encoding='utf-8') as f:
-            f.write(data)
-    except (IOError, FileNotFoundError) as e:
-        print(e)
-        return False
-
-    return True
-
-def download_files(file_list):
-    # Old method using scraping
-    # files = Files.get_files(messages)
-    if len(file_list) == 0:
-        return
-
-    # Download files
-    print("")
-    for file in file_list:
-        success = Files.download_file(args.token, file, args.files, user_map, overwrite=args.files_overwrite)
-
-        if success:
-            Status.tot_files += 1
-        else:
-            Status.file_failures += 1
-
-    # Status messages
-    print("File download complete")
-    if Status.files_already_exist == 0:
-        return
-    if args.files_overwrite:
-        print(f"{Status.files_already_exist} files were overwritten")
-    else:
-        print(f"{Status.files_already_exist} files were not downloaded as files with the same name already existed")
-
 # PROGRAM START
-args = arg_setup()
-
-# Retrieve messages
-messages = Api.get_conv_history(args.dm, Switches.date_start, Switches.date_end)
-messages.reverse()
-
-# Get user map
-print("")
-user_map = get_user_map()
-conversation_map = get_conversation_map()
-slack = Slack(user_map, conversation_map)
-
-# Write to JSON
-if args.json is not None:
-    print("Exporting raw json")
-    Status.export_json = not write_to_file(args.json, json.dumps(messages, indent=4))
-
-# Write to txt
-if args.text is not None:
-    print("Formatting text")
-    formatted_text = slack.format_messages(messages)
-    print("Exporting text")
-    Status.export_text = not write_to_file(args.text, formatted_text)
-
-if args.files is not None:
-    print("\nRetrieving list of ALL files uploaded to slack")
-    files = Api.get_file_list(args.dm, Switches.date_start, Switches.date_end)
-    print(f"Found {len(files)} file(s) that were sent in {args.dm}")
-
-    download_files(files)
-
-Status.print_warnings()
+if __name__ == '__main__':
+    args = arg_setup()
+    if args.plan:
+        Planner(args, Switches.date_start, Switches.date_end).run()
+    else:
+        Archiver(args, Switches.date_start, Switches.date_end).run()
+    Status.print_warnings()
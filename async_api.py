@@ -0,0 +1,228 @@
+import asyncio
+import datetime
+import os.path
+
+from api import Api
+from files import Files, PartFile
+from json_backend import Json
+from ratelimit import AsyncRateLimiter, RateLimiter
+from status import Status
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Asynchronous version of Api, for driving large numbers of requests from a single thread
+# Uses the same endpoints, schemas and response checks as Api, but with a pooled aiohttp session
+# Must be used as an async context manager so that the session is closed:
+#   async with AsyncApi(token) as api:
+#       messages = await api.get_conv_history(...)
+class AsyncApi:
+    CONNECTION_LIMIT = 100
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, token: str, connection_limit: int = CONNECTION_LIMIT):
+        if aiohttp is None:
+            raise ImportError("AsyncApi requires the aiohttp package to be installed")
+
+        self.token = token
+        self.connection_limit = connection_limit
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.connection_limit)
+        self.session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.session.close()
+        self.session = None
+
+    async def get_profiles(self, cursor=None):
+        params = {'limit': Api.REQUEST_COUNT_USERS}
+        if cursor is not None:
+            params['cursor'] = cursor
+
+        response = await self.get_request(Api.URL_USER_LIST, params, schema=Api.SCHEMA_USER_LIST,
+                                          timeout=Api.WAIT_TIME_TIER_2, tier=2)
+        return response['members'], Api.get_cursor(response)
+
+    async def get_user_info(self, user_id: str):
+        response = await self.get_request(Api.URL_USER_INFO, {'user': user_id}, schema=Api.SCHEMA_USER_INFO,
+                                          timeout=Api.WAIT_TIME_TIER_4, tier=4,
+                                          ok_errors=('user_not_found', 'user_not_visible'))
+        if not response['ok']:
+            return None
+        return response['user']
+
+    async def get_conversations(self, cursor=None):
+        params = {'limit': Api.REQUEST_COUNT_CONV}
+        if cursor is not None:
+            params['cursor'] = cursor
+
+        response = await self.get_request(Api.URL_CONV_LIST, params, schema=Api.SCHEMA_CONV_LIST,
+                                          timeout=Api.WAIT_TIME_TIER_2, tier=2)
+        return response['channels'], Api.get_cursor(response)
+
+    async def get_conversation_info(self, conv_id: str):
+        response = await self.get_request(Api.URL_CONV_INFO, {'channel': conv_id}, schema=Api.SCHEMA_CONV_INFO,
+                                          timeout=Api.WAIT_TIME_TIER_3, tier=3,
+                                          ok_errors=('channel_not_found', 'missing_scope'))
+        if not response['ok']:
+            return None
+
+        channel = response['channel']
+        channel.setdefault('is_im', False)
+        return channel
+
+    # Pages are chained by cursor, so they can only be retrieved one at a time
+    async def get_conv_history(self, conv, start_time: datetime, end_time: datetime):
+        print("Retrieving messages between " + Api.format_time(start_time) + " - " + Api.format_time(end_time))
+
+        params = {
+            'channel': conv,
+            'inclusive': True,
+            'oldest': start_time.timestamp(),
+            'latest': end_time.timestamp(),
+        }
+
+        messages = []
+        while True:
+            content = await self.get_request(Api.URL_HISTORY_CONV, params, schema=Api.SCHEMA_HISTORY_DM,
+                                             timeout=Api.WAIT_TIME_TIER_4, tier=4)
+
+            next_messages = content['messages']
+            if len(next_messages) == 0:
+                break
+
+            # Make sure first/last messages don't overlap
+            if len(messages) > 0 and next_messages[0]['ts'] == messages[-1]['ts']:
+                messages.extend(next_messages[1:])
+            else:
+                messages.extend(next_messages)
+
+            if not content['has_more']:
+                print("Retrieved " + str(len(messages)) + " messages")
+                break
+
+            params['cursor'] = content['response_metadata']['next_cursor']
+
+        return messages
+
+    async def get_file_list(self, channel, start_time: datetime, end_time: datetime):
+        params = {
+            'count': Api.REQUEST_COUNT_FILES,
+            'channel': channel,
+            'ts_from': start_time.timestamp(),
+            'ts_to': end_time.timestamp()
+        }
+
+        # The first page says how many pages there are, the rest are all requested at once
+        first = await self.get_file_page(params, 1)
+        responses = [first]
+        if len(first['files']) > 0 and first['paging']['pages'] > 1:
+            pages = range(2, first['paging']['pages'] + 1)
+            responses += await asyncio.gather(*(self.get_file_page(params, page) for page in pages))
+
+        file_list = []
+        for response in responses:
+            file_list.extend(response['files'])
+
+        print(f"Retrieved data about {len(file_list)}/{first['paging']['total']} files")
+        return file_list
+
+    async def get_file_page(self, params: dict, page: int):
+        params = dict(params, page=page)
+        return await self.get_request(Api.URL_FILE_LIST, params, schema=Api.SCHEMA_FILE_LIST,
+                                      timeout=Api.WAIT_TIME_TIER_3, tier=3)
+
+    # Same checks as Files.download, the file is only saved once it has fully arrived and is the right size
+    async def download(self, source: str, save_loc: str, overwrite: bool, size: int = None, mimetype: str = None,
+                       manifest=None):
+        if os.path.exists(save_loc):
+            Status.files_already_exist += 1
+
+            if not overwrite:
+                Files.record_existing(save_loc, manifest)
+                return True
+
+        Files.make_dirs(save_loc)
+        part = PartFile(save_loc)
+        try:
+            async with self.session.get(source, headers=self.auth_headers()) as response:
+                if not Files.check_response(response.status, response.headers, 200, mimetype, source):
+                    part.discard()
+                    return False
+
+                async for chunk in response.content.iter_chunked(self.DOWNLOAD_CHUNK_SIZE):
+                    part.write(chunk)
+
+            return part.commit(source, size, manifest)
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+            print("ERROR: " + str(e))
+            part.discard()
+            return False
+
+    # Same retry logic as Api.get_request, except failing raises an exception rather than exiting
+    async def get_request(self, url: str, params: dict, schema: dict = None, timeout: int = 5, tier: int = None,
+                          ok_errors: tuple = ()):
+        for attempt_num in range(Api.TIMEOUT_RETRIES):
+            if attempt_num > 0:
+                print(f"Retrying... (attempt {attempt_num + 1})")
+            if tier is not None:
+                await AsyncRateLimiter.acquire(RateLimiter.get_method(url), tier)
+
+            attempt = await self.get_request_once(url, params, schema, ok_errors)
+            if attempt is False:
+                continue
+            if attempt is True:
+                print(f"Waiting for {timeout} second(s)")
+                if tier is not None:
+                    # The wait happens when the next slot is acquired
+                    await AsyncRateLimiter.back_off(RateLimiter.get_method(url), timeout)
+                else:
+                    await asyncio.sleep(timeout)
+                continue
+
+            return attempt
+
+        raise RuntimeError(f"Maximum attempts exceeded ({Api.TIMEOUT_RETRIES}) for URL: {url}")
+
+    # Returns False for error, True for error with 429 code
+    async def get_request_once(self, url: str, params: dict, schema: dict = None, ok_errors: tuple = ()):
+        error_msg = f"Exception with request for URL: {url}"
+
+        try:
+            async with self.session.get(url, params=self.encode_params(params), headers=self.auth_headers()) as response:
+                if response.status == 429:
+                    print(error_msg)
+                    print("Status code: 429 (Too many requests)")
+                    return True
+
+                if response.status != 200:
+                    print(error_msg)
+                    print("Status code: " + str(response.status))
+                    return False
+
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(error_msg)
+            print(e)
+            return False
+
+        return Api.check_response(url, Json.loads(body), schema, ok_errors)
+
+    def auth_headers(self):
+        return {"Authorization": "Bearer " + self.token}
+
+    # aiohttp only accepts strings and numbers as query parameters
+    @staticmethod
+    def encode_params(params: dict):
+        encoded = {}
+        for key, value in params.items():
+            if isinstance(value, bool):
+                value = str(value).lower()
+            encoded[key] = value
+
+        return encoded
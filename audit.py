@@ -0,0 +1,33 @@
+import argparse
+import sys
+
+from manifest import Manifest
+
+# Verifies a downloaded files directory against its manifest without downloading anything
+def arg_setup():
+    parser = argparse.ArgumentParser(description="Check downloaded files against the manifest written when downloading")
+    parser.add_argument('directory',
+                        help="Files directory to audit (the directory given to --files)")
+    parser.add_argument('-w', '--workers', type=int,
+                        help="Number of processes to hash files with (default: number of cores)")
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = arg_setup()
+    manifest = Manifest(args.directory)
+    if len(manifest.entries) == 0:
+        print(f"No manifest found in '{args.directory}'")
+        sys.exit(-1)
+
+    print(f"Auditing {len(manifest.entries)} files in '{args.directory}'")
+    problems = manifest.audit(args.workers)
+
+    if len(problems) == 0:
+        print("All files verified successfully")
+        sys.exit(0)
+
+    print(f"\nFound {len(problems)} problem(s):")
+    for path, problem in sorted(problems.items()):
+        print(f"{path}: {problem}")
+    sys.exit(-1)
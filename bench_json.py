@@ -0,0 +1,49 @@
+import json
+import random
+import string
+import time
+import timeit
+
+from json_backend import Json
+
+# Compares the JSON backend against the standard library on synthetic history pages
+# Usage: python bench_json.py
+PAGE_SIZE = 500
+PAGES = 20
+REPEATS = 5
+
+def random_text(length):
+    return "".join(random.choice(string.ascii_letters + " ") for _ in range(length))
+
+def make_page():
+    messages = []
+    for i in range(PAGE_SIZE):
+        messages.append({
+            'type': 'message',
+            'user': 'U' + str(random.randint(10000000, 99999999)),
+            'text': random_text(random.randint(10, 400)),
+            'ts': f"{time.time() - i * 60:.6f}",
+            'reactions': [{'name': 'thumbsup', 'users': ['U12345678'], 'count': 1}],
+            'attachments': [{'title': random_text(20), 'text': random_text(100), 'fields': []}]
+        })
+
+    return {'ok': True, 'messages': messages, 'has_more': True, 'response_metadata': {'next_cursor': 'abc'}}
+
+def bench(name, func):
+    seconds = min(timeit.repeat(func, number=1, repeat=REPEATS))
+    print(f"{name:<40} {seconds * 1000:8.1f} ms")
+
+def main():
+    pages = [make_page() for _ in range(PAGES)]
+    bodies = [json.dumps(page).encode('utf-8') for page in pages]
+    messages = [msg for page in pages for msg in page['messages']]
+
+    print(f"Backend: {Json.BACKEND}, {PAGES} pages of {PAGE_SIZE} messages ({sum(map(len, bodies)) // 1024} KB)")
+    bench("parse (stdlib, decode then loads)", lambda: [json.loads(body.decode('utf-8')) for body in bodies])
+    bench("parse (backend, raw bytes)", lambda: [Json.loads(body) for body in bodies])
+    bench("export indent=4 (stdlib)", lambda: json.dumps(messages, indent=4))
+    bench("export indent=2 (stdlib)", lambda: json.dumps(messages, indent=2))
+    bench("export indent=2 (backend)", lambda: Json.dumps(messages, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import os
+import os.path
+
+from files import Files
+from filters import Filters
+from json_backend import Json
+
+# Durable record of the history pages retrieved so far, so that an interrupted run can resume from the last cursor
+# Each line holds one page of messages and the cursor for the next page, the cursor is null once everything is retrieved
+# The pages are stored after filtering, so checkpoints made with different filters are kept separately
+class Checkpoint:
+    def __init__(self, directory: str, conv: str, oldest: float, latest: float):
+        name = f"history_{conv}_{int(oldest)}_{int(latest)}"
+        filter_key = Filters.get_key()
+        if filter_key is not None:
+            name += "_" + filter_key
+        self.loc = os.path.join(directory, name + ".jsonl")
+
+        # Size of the file up to the end of the last complete line, anything after it is cut off before appending
+        self.valid_size = None
+
+    # Returns the messages retrieved so far, the cursor to carry on from, and whether the retrieval finished
+    # Pages are added to messages one at a time if it's given (e.g. a MessageBuffer), so they're never all held at once
+    def load(self, messages=None):
+        if messages is None:
+            messages = []
+        cursor = None
+        complete = False
+
+        if not os.path.exists(self.loc):
+            return messages, cursor, complete
+
+        self.valid_size = 0
+        with open(self.loc, "rb") as f:
+            for line in f:
+                # A crash while writing can leave the last line incomplete, that page will just be retrieved again
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    page = Json.loads(line)
+                except ValueError:
+                    break
+
+                messages.extend(page['messages'])
+                cursor = page['cursor']
+                complete = cursor is None
+                self.valid_size += len(line)
+
+        return messages, cursor, complete
+
+    def append(self, messages: list, cursor):
+        Files.make_dirs(self.loc)
+
+        # Drop any incomplete line left by a crash, otherwise this page would be joined onto it and lost as well
+        if self.valid_size is not None:
+            if os.path.exists(self.loc) and os.path.getsize(self.loc) > self.valid_size:
+                os.truncate(self.loc, self.valid_size)
+            self.valid_size = None
+
+        with open(self.loc, "ab") as f:
+            f.write(Json.dumps_bytes({'messages': messages, 'cursor': cursor}) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        if os.path.exists(self.loc):
+            os.remove(self.loc)
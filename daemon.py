@@ -0,0 +1,178 @@
+import argparse
+import datetime
+import os.path
+import time
+
+from api import Api
+from archive import Archiver
+from json_backend import Json
+from partitions import Partitioner
+from ratelimit import RateLimiter
+from status import Status
+from switches import Switches
+
+# Keeps a set of channels archived by syncing them on a schedule from a single long running process
+# The requests session, schema validators and user/conversation maps stay warm between syncs, and each sync only
+# retrieves messages since the last one. The output is always partitioned so that new messages are merged in
+# Config file format:
+# {
+#     "output": "archive",
+#     "interval": 3600,
+#     "partition": "MONTH",
+#     "refresh_days": 7,
+#     "text": true, "files": false,
+#     "exclude_subtypes": ["noise"], "exclude_bots": true, "file_max_size": "100MB",
+#     "channels": ["C0123456", {"id": "D0123456", "files": true}]
+# }
+class Daemon:
+    STATE_FILE = "daemon_state.json"
+    DEFAULT_INTERVAL = 3600
+    DEFAULT_PARTITION = 'MONTH'
+    DEFAULT_OUTPUTS = {'text': True, 'files': False}
+
+    # Slack messages can take a moment to show up in the history, so each sync starts slightly before the last one ended
+    SYNC_OVERLAP = datetime.timedelta(minutes=10)
+
+    JSON_FILE = "history.json"
+    TEXT_FILE = "history.txt"
+    FILES_DIR = "files"
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.output = config.get('output', 'archive')
+        self.interval = config.get('interval', self.DEFAULT_INTERVAL)
+        self.state_loc = os.path.join(self.output, self.STATE_FILE)
+        self.state = self.load_state()
+
+        # Shared by every sync
+        self.user_map = None
+        self.conversation_map = None
+
+    def run_forever(self):
+        while True:
+            started = time.monotonic()
+            self.sync_all()
+
+            wait = self.interval - (time.monotonic() - started)
+            if wait > 0:
+                print(f"\nNext sync in {int(wait)} second(s)")
+                time.sleep(wait)
+
+    def sync_all(self):
+        for channel in self.config['channels']:
+            if isinstance(channel, str):
+                channel = {'id': channel}
+            self.sync_channel(channel)
+
+    def sync_channel(self, channel: dict):
+        conv = channel['id']
+        end_time = datetime.datetime.now()
+        if conv in self.state:
+            start_time = datetime.datetime.fromtimestamp(self.state[conv]) - self.SYNC_OVERLAP
+        else:
+            start_time = Switches.date_start
+
+        # Go back further to pick up recent edits, deletions and replies
+        if 'refresh_days' in self.config:
+            start_time = min(start_time, end_time - datetime.timedelta(days=self.config['refresh_days']))
+
+        print(f"\nSyncing {conv}")
+        Status.reset()
+        archiver = Archiver(self.get_args(channel), start_time, end_time, self.user_map, self.conversation_map)
+        try:
+            archiver.run()
+            failed = Status.num_errors() > 0
+        except (SystemExit, Exception) as e:
+            # The api exits once it runs out of retries, which shouldn't stop the other channels from syncing
+            print(f"Sync of {conv} failed: {e!r}")
+            failed = True
+        Status.print_warnings()
+
+        # Keep the maps that were built up for the next sync
+        self.user_map = archiver.user_map
+        self.conversation_map = archiver.conversation_map
+
+        # Failed syncs are retried from the same point next time
+        if not failed:
+            self.state[conv] = end_time.timestamp()
+            self.save_state()
+
+    def get_args(self, channel: dict):
+        def option(name):
+            return channel.get(name, self.config.get(name, self.DEFAULT_OUTPUTS[name]))
+
+        channel_dir = os.path.join(self.output, channel['id'])
+        return argparse.Namespace(
+            token=Api.token,
+            dm=channel['id'],
+            output=channel_dir,
+            # Always written, new messages are merged into the partitions using it
+            json=self.JSON_FILE,
+            text=self.TEXT_FILE if option('text') else None,
+            files=os.path.join(channel_dir, self.FILES_DIR) if option('files') else None,
+            files_overwrite=False,
+            file_workers=self.config.get('file_workers', 1),
+            crawl_users=False,
+            crawl_conversations=False,
+            backfill_threads=self.config.get('backfill_threads', False),
+            memory_limit=self.config.get('memory_limit'),
+            checkpoint=None,
+            pipeline=self.config.get('pipeline', False)
+        )
+
+    def load_state(self):
+        if not os.path.exists(self.state_loc):
+            return {}
+
+        with open(self.state_loc, "rb") as f:
+            return Json.loads(f.read())
+
+    def save_state(self):
+        Partitioner.write_atomic(self.state_loc, Json.dumps_bytes(self.state, indent=4), Switches.Compression.NONE)
+
+def arg_setup():
+    parser = argparse.ArgumentParser(description="Keep a set of channels archived, syncing them on a schedule")
+    parser.add_argument('token',
+                        help="Slack authorisation token")
+    parser.add_argument('config',
+                        help="JSON file listing the channels to archive and how often")
+    parser.add_argument('--once', action='store_true',
+                        help="Sync every channel once and exit")
+
+    parsed_args = parser.parse_args()
+    Api.token = parsed_args.token
+
+    with open(parsed_args.config, "rb") as f:
+        config = Json.loads(f.read())
+    if 'channels' not in config:
+        parser.error("Config file must list the channels to archive")
+    if config.get('json') is False or any(isinstance(channel, dict) and channel.get('json') is False
+                                          for channel in config['channels']):
+        parser.error("Json output can't be turned off, it is needed to merge each sync into the partitions")
+    if 'rate_db' in config:
+        RateLimiter.use_database(config['rate_db'], parsed_args.token)
+
+    # Incremental syncs rely on merging new messages into the existing partitions
+    Switches.partition = Switches.convert_enum(Switches.Periods, config.get('partition', Daemon.DEFAULT_PARTITION),
+                                               "partition period", parser)
+
+    Switches.text_index = config.get('text_index', False)
+
+    # Filters apply to every channel
+    Switches.filter_users = set(config.get('filter_users', []))
+    Switches.exclude_subtypes = set(config.get('exclude_subtypes', []))
+    Switches.exclude_bots = config.get('exclude_bots', False)
+    Switches.file_types = {file_type.lower() for file_type in config.get('file_types', [])}
+    if 'file_max_size' in config:
+        Switches.file_max_size = Switches.convert_size(str(config['file_max_size']), parser)
+
+    return parsed_args, config
+
+if __name__ == '__main__':
+    args, daemon_config = arg_setup()
+    daemon = Daemon(daemon_config)
+
+    if args.once:
+        daemon.sync_all()
+    else:
+        daemon.run_forever()
@@ -1,16 +1,24 @@
+import hashlib
 import re
+import os
 import os.path
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
+from api import Api
+from progress import Progress
 from slack import Slack
 from status import Status
 
 class Files:
+    # Files at least this large are split into byte ranges that are downloaded over separate connections
+    RANGED_THRESHOLD = 64 * 1024 * 1024
+    RANGE_SIZE = 16 * 1024 * 1024
+    RANGE_CONNECTIONS = 4
+    CHUNK_SIZE = 1024 * 1024
+
     @classmethod
-    def download_file(cls, token, file, file_dir, user_map: dict, overwrite=False, ):
+    def download_file(cls, token, file, file_dir, user_map: dict, overwrite=False, manifest=None):
         download_url = file['url_private_download']
-
-        file_size = cls.bytes_to_str(file['size'])
         file_user = Slack.get_username(file, user_map)
 
         file_name = file['title']
@@ -24,8 +32,9 @@ class Files:
         save_loc = os.path.join(file_dir, file_user, save_name)
         Files.make_dirs(save_loc)
 
-        print("Downloading file from '" + download_url + "' (" + file_size + ")")
-        return cls.download(download_url, save_loc, overwrite, token)
+        success = cls.download(download_url, save_loc, overwrite, token, file['size'], file.get('mimetype'), manifest)
+        Progress.update("downloads", num_bytes=file['size'])
+        return success
 
     @staticmethod
     def bytes_to_str(size: int, precision=2):
@@ -37,30 +46,133 @@ class Files:
             size = size / 1024.0  # apply the division
         return "%.*f%s" % (precision, size, suffixes[suffix_index])
 
-    @staticmethod
-    def download(source: str, save_loc: str, overwrite: bool, token: str):
+    # The file is streamed to a temporary file and hashed as it arrives, it only replaces save_loc if it's the right size
+    # If a manifest is given then the size and checksum are recorded in it
+    @classmethod
+    def download(cls, source: str, save_loc: str, overwrite: bool, token: str, size: int = None, mimetype: str = None,
+                 manifest=None):
         if os.path.exists(save_loc):
-            Status.files_already_exist += 1
+            with Status.lock:
+                Status.files_already_exist += 1
 
             if not overwrite:
-                print("File already exists in download location '" + save_loc + "'")
+                cls.record_existing(save_loc, manifest)
                 return True
-            else:
-                print("File already exists, overwriting")
+
+        if size is not None and size >= cls.RANGED_THRESHOLD:
+            result = cls.download_ranged(source, save_loc, token, size, mimetype, manifest)
+            if result is not None:
+                return result
+            Progress.info("Server does not support ranged requests, downloading over a single connection")
+
+        part = PartFile(save_loc)
+        try:
+            with Api.session.get(source, headers={"Authorization": "Bearer " + token}, stream=True) as response:
+                if not cls.check_response(response.status_code, response.headers, 200, mimetype, source):
+                    part.discard()
+                    return False
+
+                for chunk in response.iter_content(cls.CHUNK_SIZE):
+                    part.write(chunk)
+
+            return part.commit(source, size, manifest)
+        except Exception as e:
+            print("ERROR: " + str(e))
+            part.discard()
+            return False
+
+    # Files downloaded before there was a manifest (or by older versions) are added to it, so they can be audited
+    @staticmethod
+    def record_existing(save_loc: str, manifest=None):
+        if manifest is not None and not manifest.contains(save_loc):
+            manifest.record(save_loc, os.path.getsize(save_loc), manifest.hash_file(save_loc))
+
+    # Slack serves a HTML page instead of the file for some errors (e.g. expired links), so don't save those
+    @staticmethod
+    def check_response(status: int, headers, expected_status: int, mimetype: str, source: str):
+        if status != expected_status:
+            print(f"ERROR: Status code {status} when downloading '{source}'")
+            return False
+
+        content_type = headers.get('Content-Type', '').split(';')[0].strip()
+        if content_type == 'text/html' and mimetype is not None and mimetype != 'text/html':
+            print(f"ERROR: Received a HTML page instead of {mimetype} when downloading '{source}'")
+            return False
+
+        return True
+
+    # Downloads the file in byte ranges over parallel connections into a temporary file, which replaces save_loc
+    # once every range has arrived and the size has been checked
+    # Each range is hashed as it arrives, and since the hashes can't be combined the manifest records one per range
+    # Returns None if the server doesn't support ranges, so that the caller can fall back to a single request
+    @classmethod
+    def download_ranged(cls, source: str, save_loc: str, token: str, size: int, mimetype: str = None, manifest=None):
+        tmp_loc = save_loc + ".part"
+        ranges = [(start, min(start + cls.RANGE_SIZE, size) - 1) for start in range(0, size, cls.RANGE_SIZE)]
 
         try:
-            response = requests.get(source, headers={"Authorization": "Bearer " + token})
-            if not isinstance(response, requests.Response):
+            # Preallocate the file so each range can be written at its offset
+            with open(tmp_loc, "wb") as f:
+                f.truncate(size)
+
+            # Try the first range on its own, so a server that ignores ranges isn't sent a request for every range
+            results = [cls.download_range(source, tmp_loc, token, *ranges[0], mimetype)]
+            if results[0]:
+                with ThreadPoolExecutor(max_workers=cls.RANGE_CONNECTIONS) as executor:
+                    results.extend(executor.map(
+                        lambda byte_range: cls.download_range(source, tmp_loc, token, *byte_range, mimetype), ranges[1:]))
+
+            if not all(results):
+                os.remove(tmp_loc)
+                return None if None in results else False
+
+            if os.path.getsize(tmp_loc) != size:
+                print(f"ERROR: Downloaded file is {os.path.getsize(tmp_loc)} bytes, expected {size}")
+                os.remove(tmp_loc)
                 return False
 
-            with open(save_loc, "wb") as f:
-                f.write(response.content)
+            os.replace(tmp_loc, save_loc)
         except Exception as e:
             print("ERROR: " + str(e))
+            if os.path.exists(tmp_loc):
+                os.remove(tmp_loc)
             return False
 
+        if manifest is not None:
+            manifest.record_ranges(save_loc, size, cls.RANGE_SIZE, results)
         return True
 
+    # Returns None if the server ignored the range (or sent a different one), False if it failed,
+    # otherwise the SHA-256 of the range
+    @classmethod
+    def download_range(cls, source: str, loc: str, token: str, start: int, end: int, mimetype: str = None):
+        headers = {"Authorization": "Bearer " + token, "Range": f"bytes={start}-{end}"}
+
+        with Api.session.get(source, headers=headers, stream=True) as response:
+            if response.status_code == 200:
+                return None
+            if not cls.check_response(response.status_code, response.headers, 206, mimetype, source):
+                return False
+
+            content_range = response.headers.get('Content-Range', '')
+            if not content_range.startswith(f"bytes {start}-{end}/"):
+                print(f"ERROR: Requested bytes {start}-{end} but received '{content_range}' from '{source}'")
+                return None
+
+            written = 0
+            digest = hashlib.sha256()
+            with open(loc, "r+b") as f:
+                f.seek(start)
+                for chunk in response.iter_content(cls.CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+
+        if written != end - start + 1:
+            print(f"ERROR: Received {written} bytes for bytes {start}-{end}")
+            return False
+        return digest.hexdigest()
+
     @staticmethod
     def make_dirs(loc):
         directory = os.path.dirname(loc)
@@ -68,3 +180,46 @@ class Files:
             return
 
         os.makedirs(directory, exist_ok=True)
+
+# A download in progress, which is streamed to save_loc + ".part" and hashed as it arrives
+# It only replaces save_loc once it has been checked, so a failed download never leaves a truncated file behind
+# that later runs would skip as already downloaded
+class PartFile:
+    def __init__(self, save_loc: str):
+        self.save_loc = save_loc
+        self.tmp_loc = save_loc + ".part"
+        self.digest = hashlib.sha256()
+        self.written = 0
+        self.__file = None
+
+    def write(self, chunk: bytes):
+        self.open()
+        self.__file.write(chunk)
+        self.digest.update(chunk)
+        self.written += len(chunk)
+
+    # Returns whether the file was saved, if a manifest is given then the size and checksum are recorded in it
+    def commit(self, source: str, size: int = None, manifest=None):
+        # Opened here as well, in case nothing was written
+        self.open()
+        self.__file.close()
+        if size is not None and self.written != size:
+            print(f"ERROR: Downloaded {self.written} bytes from '{source}', expected {size}")
+            self.discard()
+            return False
+
+        os.replace(self.tmp_loc, self.save_loc)
+        if manifest is not None:
+            manifest.record(self.save_loc, self.written, self.digest.hexdigest())
+        return True
+
+    def discard(self):
+        if self.__file is not None:
+            self.__file.close()
+        if os.path.exists(self.tmp_loc):
+            os.remove(self.tmp_loc)
+
+    # Not opened until needed, so that creating one can't fail
+    def open(self):
+        if self.__file is None:
+            self.__file = open(self.tmp_loc, "wb")
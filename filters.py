@@ -0,0 +1,67 @@
+import hashlib
+import json
+
+from slack import Slack
+from switches import Switches
+
+# Drops the messages and files that aren't wanted as soon as they're retrieved, so they're never stored or formatted
+# The filters are set through Switches, and everything is kept if none are set
+class Filters:
+    # Can be given as a subtype to exclude all the join/leave/topic etc. messages
+    SUBTYPE_NOISE = 'noise'
+
+    @classmethod
+    def message_filters_active(cls):
+        return len(Switches.filter_users) > 0 or len(Switches.exclude_subtypes) > 0 or Switches.exclude_bots
+
+    @classmethod
+    def file_filters_active(cls):
+        return len(Switches.filter_users) > 0 or len(Switches.file_types) > 0 or Switches.file_max_size is not None
+
+    # Identifies the message filters, for anything that stores filtered messages. None if there are no filters
+    @classmethod
+    def get_key(cls):
+        if not cls.message_filters_active():
+            return None
+
+        filters = [sorted(Switches.filter_users), sorted(Switches.exclude_subtypes), Switches.exclude_bots]
+        return hashlib.sha256(json.dumps(filters, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()[:12]
+
+    @classmethod
+    def filter_messages(cls, messages: list):
+        if not cls.message_filters_active():
+            return messages
+        return [msg for msg in messages if cls.keep_message(msg)]
+
+    @classmethod
+    def filter_files(cls, files: list):
+        if not cls.file_filters_active():
+            return files
+        return [file for file in files if cls.keep_file(file)]
+
+    @classmethod
+    def keep_message(cls, msg: dict):
+        if len(Switches.filter_users) > 0 and msg.get('user') not in Switches.filter_users:
+            return False
+
+        subtype = msg.get('subtype')
+        if subtype in Switches.exclude_subtypes:
+            return False
+        if cls.SUBTYPE_NOISE in Switches.exclude_subtypes and subtype in Slack.SUBTYPES_NO_PREFIX:
+            return False
+
+        if Switches.exclude_bots and ('bot_id' in msg or subtype == 'bot_message'):
+            return False
+
+        return True
+
+    @classmethod
+    def keep_file(cls, file: dict):
+        if len(Switches.filter_users) > 0 and file.get('user') not in Switches.filter_users:
+            return False
+        if len(Switches.file_types) > 0 and file.get('filetype') not in Switches.file_types:
+            return False
+        if Switches.file_max_size is not None and file.get('size', 0) > Switches.file_max_size:
+            return False
+
+        return True
@@ -0,0 +1,104 @@
+import mmap
+import tempfile
+
+from json_backend import Json
+from progress import Progress
+
+# Holds messages in the order they are retrieved (newest first), spilling them to a temporary file once there are
+# more than memory_limit in memory. Messages are stored one JSON document per line, so the file can be read
+# backwards to give the messages in chronological order without ever loading it all into memory
+class MessageBuffer:
+    def __init__(self, memory_limit: int, directory: str = None):
+        self.memory_limit = memory_limit
+        self.directory = directory
+
+        self.__memory = []
+        self.__file = None
+        self.__num_spilled = 0
+        self.__last = None
+
+    def __len__(self):
+        return self.__num_spilled + len(self.__memory)
+
+    # Only the last message is needed to check for overlapping pages
+    def __getitem__(self, index):
+        if index != -1 or self.__last is None:
+            raise IndexError("Only the last message of a non-empty buffer can be accessed")
+        return self.__last
+
+    def extend(self, messages):
+        messages = list(messages)
+        if len(messages) == 0:
+            return
+
+        self.__memory.extend(messages)
+        self.__last = messages[-1]
+
+        if len(self.__memory) >= self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        if self.__file is None:
+            self.__file = tempfile.TemporaryFile(dir=self.directory)
+            Progress.info(f"Spilling messages to disk after {len(self.__memory)} messages")
+
+        self.__file.write(b"".join(Json.dumps_bytes(msg) + b"\n" for msg in self.__memory))
+        self.__num_spilled += len(self.__memory)
+        self.__memory = []
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    # Newest first, the order slack returns them in
+    def __iter__(self):
+        with self.map_file() as mapped:
+            pos = 0
+            while pos < len(mapped):
+                end = mapped.find(b"\n", pos)
+                yield Json.loads(mapped[pos:end])
+                pos = end + 1
+
+        yield from self.__memory
+
+    # Oldest first, the order messages are exported in
+    def __reversed__(self):
+        yield from reversed(self.__memory)
+
+        with self.map_file() as mapped:
+            # Skip the final newline
+            end = len(mapped) - 1
+            while end > 0:
+                start = mapped.rfind(b"\n", 0, end) + 1
+                yield Json.loads(mapped[start:end])
+                end = start - 1
+
+    def map_file(self):
+        if self.__file is None or self.__num_spilled == 0:
+            return EmptyMap()
+
+        self.__file.flush()
+        return mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # View of the buffer that can be iterated over multiple times in chronological order
+    def chronological(self):
+        return ChronologicalView(self)
+
+class ChronologicalView:
+    def __init__(self, buffer: MessageBuffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __iter__(self):
+        return reversed(self.buffer)
+
+# Stand in for an mmap of a file with nothing spilled to it yet
+class EmptyMap(bytes):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
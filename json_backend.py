@@ -0,0 +1,28 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Uses orjson for parsing and serialising when it's installed, falling back to the standard library when it isn't
+# orjson only supports an indent of 2, so other indents (including the default export indent of 4) use the standard library
+class Json:
+    BACKEND = "json" if orjson is None else "orjson"
+
+    # Accepts bytes as well as str, so responses don't need to be decoded before being parsed
+    @staticmethod
+    def loads(data):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj, indent: int = None):
+        return Json.dumps_bytes(obj, indent).decode('utf-8')
+
+    @staticmethod
+    def dumps_bytes(obj, indent: int = None):
+        if orjson is not None and indent in (None, 2):
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent == 2 else 0)
+        return json.dumps(obj, indent=indent).encode('utf-8')
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import os.path
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from json_backend import Json
+
+# Record of the size and SHA-256 of every downloaded file, stored in the root of the files directory
+# An archive can be audited against it later to find missing, truncated or corrupted files without downloading them
+# Files downloaded in ranges have a SHA-256 for each range instead, as they're hashed while the ranges stream in
+class Manifest:
+    FILE_NAME = "manifest.json"
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.loc = os.path.join(directory, self.FILE_NAME)
+        self.entries = {}
+        self.__lock = threading.Lock()
+
+        if os.path.exists(self.loc):
+            with open(self.loc, "rb") as f:
+                self.entries = Json.loads(f.read())
+
+    def record(self, loc: str, size: int, sha256: str):
+        with self.__lock:
+            self.entries[self.relative_path(loc)] = {'size': size, 'sha256': sha256}
+
+    def record_ranges(self, loc: str, size: int, range_size: int, range_sha256: list):
+        with self.__lock:
+            self.entries[self.relative_path(loc)] = {'size': size, 'range_size': range_size,
+                                                     'range_sha256': range_sha256}
+
+    def contains(self, loc: str):
+        with self.__lock:
+            return self.relative_path(loc) in self.entries
+
+    def save(self):
+        with self.__lock:
+            data = Json.dumps_bytes(dict(sorted(self.entries.items())), indent=4)
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_loc = self.loc + ".tmp"
+        with open(tmp_loc, "wb") as f:
+            f.write(data)
+        os.replace(tmp_loc, self.loc)
+
+    # Paths are stored with forward slashes so that manifests are portable
+    def relative_path(self, loc: str):
+        return os.path.relpath(loc, self.directory).replace(os.sep, "/")
+
+    # Re-verifies every file in the manifest, hashing them in parallel across processes
+    # Returns a dict of relative path -> problem for every file that failed, plus files not in the manifest
+    def audit(self, workers: int = None):
+        problems = {}
+        paths = sorted(self.entries)
+        locs = [os.path.join(self.directory, *path.split("/")) for path in paths]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, result in zip(paths, executor.map(self.check_file, locs, [self.entries[p] for p in paths],
+                                                        chunksize=16)):
+                if result is not None:
+                    problems[path] = result
+
+        for root, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                path = self.relative_path(os.path.join(root, file_name))
+                if path not in self.entries and path != self.FILE_NAME:
+                    problems[path] = "not in manifest"
+
+        return problems
+
+    # Returns None if the file is intact, otherwise a description of the problem
+    @classmethod
+    def check_file(cls, loc: str, entry: dict):
+        if not os.path.exists(loc):
+            return "missing"
+
+        size = os.path.getsize(loc)
+        if size != entry['size']:
+            return f"size is {size} bytes, expected {entry['size']}"
+
+        if 'range_sha256' in entry:
+            if cls.hash_ranges(loc, entry['range_size']) != entry['range_sha256']:
+                return "checksum does not match"
+        elif cls.hash_file(loc) != entry['sha256']:
+            return "checksum does not match"
+
+        return None
+
+    @classmethod
+    def hash_file(cls, loc: str):
+        digest = hashlib.sha256()
+        with open(loc, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), b""):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    @classmethod
+    def hash_ranges(cls, loc: str, range_size: int):
+        digests = []
+        with open(loc, "rb") as f:
+            while True:
+                digest = hashlib.sha256()
+                remaining = range_size
+                while remaining > 0:
+                    chunk = f.read(min(cls.CHUNK_SIZE, remaining))
+                    if len(chunk) == 0:
+                        break
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+
+                if remaining == range_size:
+                    return digests
+                digests.append(digest.hexdigest())
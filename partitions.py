@@ -0,0 +1,255 @@
+import collections
+import datetime
+import hashlib
+import itertools
+import os
+import os.path
+
+from files import Files
+from json_backend import Json
+from progress import Progress
+from slack import Slack
+from switches import Switches
+from writers import SegmentWriter, TextIndex
+
+# Keeps track of the partitions in an output directory, so that partitions which haven't changed aren't rewritten
+class PartitionIndex:
+    FILE_NAME = "index.json"
+
+    def __init__(self, directory: str, period):
+        self.loc = os.path.join(directory, self.FILE_NAME)
+        self.period = period
+        self.partitions = {}
+
+        if os.path.exists(self.loc):
+            with open(self.loc, "rb") as f:
+                index = Json.loads(f.read())
+
+            # Partitions from a different period don't line up, so start from scratch
+            if index.get('period') == period.name:
+                self.partitions = index['partitions']
+
+    def is_current(self, file_name: str, digest: str):
+        entry = self.partitions.get(file_name)
+        if entry is None or entry['sha256'] != digest:
+            return False
+
+        return os.path.exists(os.path.join(os.path.dirname(self.loc), file_name))
+
+    # Keys of the partitions of an output that have messages in the given range
+    def keys_in_range(self, output: tuple, compression, start_ts: float, end_ts: float):
+        keys = set()
+        for file_name, entry in self.partitions.items():
+            if file_name != os.path.basename(Partitioner.get_partition_loc(output, entry['partition'], compression)):
+                continue
+
+            if float(entry['first_ts']) < end_ts and float(entry['last_ts']) >= start_ts:
+                keys.add(entry['partition'])
+
+        return keys
+
+    def remove(self, file_name: str):
+        self.partitions.pop(file_name, None)
+
+    def update(self, file_name: str, key: str, digest: str, messages: list):
+        self.partitions[file_name] = {
+            'partition': key,
+            'sha256': digest,
+            'messages': len(messages),
+            'first_ts': messages[0]['ts'],
+            'last_ts': messages[-1]['ts']
+        }
+
+    def save(self):
+        index = {
+            'period': self.period.name,
+            'partitions': dict(sorted(self.partitions.items()))
+        }
+        Partitioner.write_atomic(self.loc, Json.dumps_bytes(index, indent=4), Switches.Compression.NONE)
+
+# Splits the exports into one file per period, with an index of the partitions in each output directory
+# Partitions that cover the edges of the retrieved range are merged with the messages already in the JSON partition,
+# so that only the new messages need to be retrieved
+class Partitioner:
+    def __init__(self, period, output_dir: str, start_time: datetime, end_time: datetime):
+        self.period = period
+        self.output_dir = output_dir
+        self.start_ts = start_time.timestamp()
+        self.end_ts = end_time.timestamp()
+        self.indexes = {}
+
+        self.partitions_written = 0
+        self.partitions_unchanged = 0
+        self.changes = collections.Counter()
+
+    def export(self, messages: list, json_file: str = None, text_file: str = None, slack: Slack = None,
+               thread_msgs: dict = None):
+        json_loc = self.get_output(json_file)
+        text_loc = self.get_output(text_file)
+        if thread_msgs is None:
+            thread_msgs = Slack.get_thread_msgs(messages)
+
+        # Stored partitions in the retrieved range need revisiting even if they have no messages now,
+        # since everything in them may have been deleted
+        stored_keys = set()
+        if json_loc is not None:
+            stored_keys = self.get_index(json_loc[0]).keys_in_range(json_loc, Switches.json_compression,
+                                                                    self.start_ts, self.end_ts)
+
+        for key, new_messages in itertools.groupby(messages, self.get_key):
+            stored_keys.discard(key)
+            self.export_partition(key, list(new_messages), json_loc, text_loc, slack, thread_msgs)
+
+        for key in sorted(stored_keys):
+            self.export_partition(key, [], json_loc, text_loc, slack, thread_msgs)
+
+        for index in self.indexes.values():
+            index.save()
+
+        Progress.info(f"Wrote {self.partitions_written} partition(s), {self.partitions_unchanged} were unchanged")
+        if sum(self.changes.values()) > 0:
+            Progress.info("Changes to previously archived messages: " +
+                  ", ".join(f"{count} {change}" for change, count in sorted(self.changes.items())))
+
+    def export_partition(self, key: str, new_messages: list, json_loc, text_loc, slack: Slack, thread_msgs: dict):
+        partition_msgs = self.merge(key, new_messages, json_loc)
+        if len(partition_msgs) == 0:
+            self.remove_partition(json_loc, key, Switches.json_compression)
+            self.remove_partition(text_loc, key, Switches.text_compression)
+            return
+
+        if json_loc is not None:
+            content = Json.dumps(partition_msgs, Switches.json_indent)
+            self.write_partition(json_loc, key, content, partition_msgs, Switches.json_compression)
+
+        if text_loc is not None:
+            # Messages kept from the existing partition take priority, without copying the whole run's threads each time
+            partition_threads = collections.ChainMap(Slack.get_thread_msgs(partition_msgs), thread_msgs)
+            if Switches.text_index:
+                content, text_index = self.format_indexed(slack, partition_msgs, partition_threads)
+            else:
+                content, text_index = slack.format_messages(partition_msgs, thread_msgs=partition_threads), None
+            self.write_partition(text_loc, key, content, partition_msgs, Switches.text_compression, text_index)
+
+    # Same as Slack.format_messages, but also builds the TextIndex for the output
+    @staticmethod
+    def format_indexed(slack: Slack, messages: list, thread_msgs):
+        text_index = TextIndex()
+        texts = []
+        offset = 0
+        for msg, text in slack.iter_formatted(messages, thread_msgs=thread_msgs):
+            text_index.add(msg['ts'], text, offset)
+            texts.append(text)
+            offset += len(text.encode('utf-8'))
+
+        # Shift the offsets to account for the leading whitespace that's stripped
+        content = "".join(texts)
+        stripped = content.lstrip()
+        shift = len(content[:len(content) - len(stripped)].encode('utf-8'))
+        for entry in text_index.days + text_index.messages:
+            entry[1] = max(0, entry[1] - shift)
+
+        return stripped.rstrip(), text_index
+
+    # Keep any messages in an existing partition that fall outside of the retrieved range
+    def merge(self, key: str, messages: list, json_loc):
+        if json_loc is None:
+            return messages
+
+        loc = self.get_partition_loc(json_loc, key, Switches.json_compression)
+        if not os.path.exists(loc):
+            return messages
+
+        existing = Json.loads(SegmentWriter.read_stream(loc, Switches.json_compression))
+        kept = [msg for msg in existing if not self.start_ts <= float(msg['ts']) < self.end_ts]
+        self.count_changes([msg for msg in existing if self.start_ts <= float(msg['ts']) < self.end_ts], messages)
+        if len(kept) == 0:
+            return messages
+
+        return sorted(kept + messages, key=lambda msg: float(msg['ts']))
+
+    # Compares the archived messages in the retrieved range with what was retrieved
+    def count_changes(self, archived: list, retrieved: list):
+        archived = {msg['ts']: msg for msg in archived}
+        retrieved = {msg['ts']: msg for msg in retrieved}
+
+        for ts, msg in retrieved.items():
+            old = archived.get(ts)
+            if old is None:
+                self.changes['new'] += 1
+            elif msg.get('subtype') == 'tombstone' and old.get('subtype') != 'tombstone':
+                self.changes['deleted (tombstoned)'] += 1
+            elif msg.get('edited', {}).get('ts') != old.get('edited', {}).get('ts'):
+                self.changes['edited'] += 1
+            elif msg.get('reply_count') != old.get('reply_count') or msg.get('latest_reply') != old.get('latest_reply'):
+                self.changes['threads updated'] += 1
+            elif msg != old:
+                self.changes['otherwise changed'] += 1
+
+        deleted = sum(1 for ts in archived if ts not in retrieved)
+        if deleted > 0:
+            self.changes['deleted'] += deleted
+
+    def remove_partition(self, output: tuple, key: str, compression):
+        if output is None:
+            return
+
+        loc = self.get_partition_loc(output, key, compression)
+        for file in (loc, loc + TextIndex.EXT):
+            if os.path.exists(file):
+                os.remove(file)
+        self.get_index(output[0]).remove(os.path.basename(loc))
+
+    def write_partition(self, output: tuple, key: str, content: str, messages: list, compression,
+                        text_index: TextIndex = None):
+        directory, ext = output
+        loc = self.get_partition_loc(output, key, compression)
+        file_name = os.path.basename(loc)
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+        index = self.get_index(directory)
+        if index.is_current(file_name, digest):
+            # An unchanged partition may not have been indexed before
+            if text_index is not None and not os.path.exists(loc + TextIndex.EXT):
+                self.write_atomic(loc + TextIndex.EXT, text_index.dumps_bytes(file_name), Switches.Compression.NONE)
+            self.partitions_unchanged += 1
+            return
+
+        self.write_atomic(loc, content.encode('utf-8'), compression)
+        if text_index is not None:
+            self.write_atomic(loc + TextIndex.EXT, text_index.dumps_bytes(file_name), Switches.Compression.NONE)
+        elif os.path.exists(loc + TextIndex.EXT):
+            # The offsets in an old index no longer match the content
+            os.remove(loc + TextIndex.EXT)
+        index.update(file_name, key, digest, messages)
+        self.partitions_written += 1
+
+    def get_index(self, directory: str):
+        if directory not in self.indexes:
+            self.indexes[directory] = PartitionIndex(directory, self.period)
+        return self.indexes[directory]
+
+    def get_key(self, msg: dict):
+        return datetime.datetime.fromtimestamp(float(msg['ts'])).strftime(self.period.value)
+
+    # The output file name without its extension is used as the directory for the partitions
+    def get_output(self, file: str):
+        if file is None:
+            return None
+
+        base, ext = os.path.splitext(os.path.join(self.output_dir, file))
+        return base, ext
+
+    @staticmethod
+    def get_partition_loc(output: tuple, key: str, compression):
+        directory, ext = output
+        return os.path.join(directory, key + ext + compression.value)
+
+    # Write to a temporary file first so that an interrupted run never leaves a partition half written
+    @staticmethod
+    def write_atomic(loc: str, data: bytes, compression):
+        Files.make_dirs(loc)
+        tmp_loc = loc + ".tmp"
+        with SegmentWriter.open_stream(tmp_loc, compression) as f:
+            f.write(data)
+        os.replace(tmp_loc, loc)
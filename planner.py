@@ -0,0 +1,189 @@
+import argparse
+import datetime
+import math
+import time
+
+from api import Api
+from filters import Filters
+from json_backend import Json
+from ratelimit import RateLimiter
+from resolvers import ConversationMap, LazyMap, UserMap
+from switches import Switches
+
+# Estimates how long an export will take and how much it will write, without doing the export
+# Only a few cheap requests are made: the conversation info (for when it was created), the newest page of history
+# and the first page of the file list. Everything else is extrapolated from those, so the numbers are rough:
+# the history is assumed to be as dense as its newest page, and the files as large as those on the first page
+class Planner:
+    # Downloads aren't rate limited, so their time depends on the connection, which can't be probed cheaply
+    ASSUMED_DOWNLOAD_RATE = 10 * 1024 * 1024
+
+    # Roughly what the text output adds to each message (timestamp, newlines, indentation)
+    TEXT_OVERHEAD = 16
+
+    def __init__(self, args: argparse.Namespace, start_time: datetime, end_time: datetime,
+                 user_map: dict = None, conversation_map: dict = None):
+        self.args = args
+        self.start_time = start_time
+        self.end_time = end_time
+        self.user_map = user_map
+        self.conversation_map = conversation_map
+
+        # Estimated number of requests keyed by (tier, description), descriptions start with the method name
+        self.requests = {}
+        self.parallel_requests = {}
+        self.latency = 0
+        self.messages = 0
+        self.output_bytes = {}
+        self.file_count = 0
+        self.file_bytes = 0
+
+    def run(self):
+        print("Planning export, no messages or files will be saved")
+        sample = self.probe_history()
+        self.plan_mappings(sample)
+        if self.args.files is not None:
+            self.probe_files()
+
+        self.print_plan()
+
+    def probe_history(self):
+        start_ts = self.start_time.timestamp()
+        # There are no messages in the future, so don't count any of the range after now (e.g. the default end date)
+        end_ts = min(self.end_time.timestamp(), time.time())
+
+        # There's nothing to retrieve from before the conversation existed
+        info = Api.get_conversation_info(self.args.dm)
+        if info is not None and 'created' in info:
+            start_ts = max(start_ts, info['created'])
+        self.add_requests(3, "conversations.info", 1)
+
+        params = Api.get_history_params(self.args.dm, self.start_time, self.end_time)
+        probe_start = time.monotonic()
+        content = Api.get_history_page(params)
+        self.latency = time.monotonic() - probe_start
+
+        page = content['messages']
+        num_pages = 1
+        num_messages = len(page)
+        if content['has_more'] and len(page) > 0:
+            # Pages are newest first, so the page covers from the end of the range (or now) back to its oldest message
+            covered = max(end_ts - float(page[-1]['ts']), 1)
+            num_messages = len(page) * max(end_ts - start_ts, covered) / covered
+            num_pages = math.ceil(num_messages / len(page))
+        self.add_requests(4, "conversations.history", num_pages)
+
+        sample = Filters.filter_messages(page)
+        scale = num_messages / len(page) if len(page) > 0 else 0
+        self.messages = round(len(sample) * scale)
+
+        if self.args.backfill_threads:
+            threads = sum(1 for msg in sample if msg.get('reply_count', 0) > 0 and msg.get('thread_ts') == msg['ts'])
+            self.add_requests(3, "conversations.replies (at most)", round(threads * scale), parallel=True)
+
+        if len(sample) > 0:
+            json_size = sum(len(Json.dumps_bytes(msg, Switches.json_indent)) for msg in sample) / len(sample)
+            text_size = sum(len(msg.get('text', "").encode('utf-8')) + self.TEXT_OVERHEAD for msg in sample) / len(sample)
+            if self.args.json is not None:
+                self.output_bytes["json"] = round(json_size * self.messages)
+            if self.args.text is not None:
+                self.output_bytes["text"] = round(text_size * self.messages)
+
+        return sample
+
+    # Maps that are passed in are already warm, so only the IDs they're missing need looking up
+    # The distinct IDs in the sample are a lower bound on how many will be looked up
+    def plan_mappings(self, sample: list):
+        self.plan_mapping(self.user_map, self.args.crawl_users, UserMap.collect_ids(sample),
+                          (2, "users.list"), (4, "users.info"))
+        self.plan_mapping(self.conversation_map, self.args.crawl_conversations, ConversationMap.collect_ids(sample),
+                          (2, "conversations.list"), (3, "conversations.info"))
+
+    def plan_mapping(self, mapping: dict, crawl: bool, ids: set, crawl_request: tuple, lookup_request: tuple):
+        if mapping is not None and not isinstance(mapping, LazyMap):
+            return
+
+        if mapping is None and crawl:
+            tier, description = crawl_request
+            self.add_requests(tier, description + " (at least)", 1)
+            return
+
+        known = mapping if mapping is not None else {}
+        tier, description = lookup_request
+        self.add_requests(tier, description + " (at least)", sum(1 for key in ids if key not in known), parallel=True)
+
+    def probe_files(self):
+        params = Api.get_file_list_params(self.args.dm, self.start_time, self.end_time)
+        response = Api.get_file_page(params, 1)
+        self.add_requests(3, "files.list", max(response['paging']['pages'], 1), parallel=True)
+
+        page = response['files']
+        if len(page) == 0:
+            return
+
+        kept = Filters.filter_files(page)
+        scale = response['paging']['total'] / len(page)
+        self.file_count = round(len(kept) * scale)
+        self.file_bytes = round(sum(file['size'] for file in kept) * scale)
+
+    def add_requests(self, tier: int, description: str, count: int, parallel=False):
+        if count == 0:
+            return
+
+        requests = self.parallel_requests if parallel else self.requests
+        requests[(tier, description)] = count
+
+    # Requests made one after another wait for the previous response as well as the rate limiter,
+    # concurrent requests are only held back by the rate limiter
+    def get_request_time(self, tier: int, count: int, parallel: bool):
+        interval = RateLimiter.get_interval(tier)
+        if parallel:
+            return count * interval
+        return count * max(interval, self.latency)
+
+    def print_plan(self):
+        print("")
+        print(f"Estimated messages: {self.messages}")
+
+        print("Estimated requests:")
+        method_times = {}
+        for parallel, requests in ((False, self.requests), (True, self.parallel_requests)):
+            for (tier, description), count in sorted(requests.items()):
+                print(f"    Tier {tier} {description}: {count}")
+                method = (tier, description.split(" ")[0])
+                method_times[method] = method_times.get(method, 0) + self.get_request_time(tier, count, parallel)
+
+        # Each method has its own limit
+        for (tier, method), seconds in sorted(method_times.items()):
+            print(f"Time spent on {method} requests ({RateLimiter.TIER_LIMITS[tier]} per minute): "
+                  f"{self.format_duration(seconds)}")
+
+        download_time = self.file_bytes / self.ASSUMED_DOWNLOAD_RATE
+        if self.args.files is not None:
+            print(f"Estimated files: {self.file_count} ({self.format_bytes(self.file_bytes)}), "
+                  f"downloading for {self.format_duration(download_time)} at "
+                  f"{self.format_bytes(self.ASSUMED_DOWNLOAD_RATE)}/s")
+
+        # Methods have separate limits, so when pipelined they overlap with each other and the downloads
+        if self.args.pipeline:
+            wall_time = max([download_time] + list(method_times.values()))
+        else:
+            wall_time = download_time + sum(method_times.values())
+        print(f"Predicted wall time: {self.format_duration(wall_time)}")
+
+        for output, size in sorted(self.output_bytes.items()):
+            print(f"Estimated {output} output: {self.format_bytes(size)} (before compression)")
+        total = sum(self.output_bytes.values()) + self.file_bytes
+        print(f"Predicted disk footprint: {self.format_bytes(total)}")
+
+    @staticmethod
+    def format_duration(seconds: float):
+        return str(datetime.timedelta(seconds=round(seconds)))
+
+    @staticmethod
+    def format_bytes(size: float):
+        for unit in ("B", "KB", "MB"):
+            if size < 1024:
+                return f"{size:.1f} {unit}"
+            size /= 1024
+        return f"{size:.1f} GB"
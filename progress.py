@@ -0,0 +1,147 @@
+import sys
+import threading
+import time
+
+from json_backend import Json
+from switches import Switches
+
+# Reports progress for each phase of a run (e.g. history, file list, downloads) without printing a line per item
+# Events are throttled to one per phase every INTERVAL seconds, plus one when the phase starts and finishes
+# Depending on Switches.progress_mode events are printed as text, JSON lines (on stderr), a live bar or not at all
+class Progress:
+    INTERVAL = 1.0
+    BAR_WIDTH = 30
+
+    __lock = threading.Lock()
+    __phases = {}
+
+    class Phase:
+        def __init__(self, name: str, unit: str, total: int = None, total_bytes: int = None):
+            self.name = name
+            self.unit = unit
+            self.total = total
+            self.total_bytes = total_bytes
+            self.done = 0
+            self.bytes = 0
+            self.started = time.monotonic()
+            self.last_emit = 0
+
+    # Prints a status message about the run, these are muted along with the progress in quiet mode
+    # Errors and warnings are always printed, so they shouldn't go through this
+    @staticmethod
+    def info(*args):
+        if Switches.progress_mode != Switches.ProgressModes.QUIET:
+            print(*args)
+
+    @classmethod
+    def start(cls, name: str, unit: str = "items", total: int = None, total_bytes: int = None):
+        with cls.__lock:
+            phase = cls.Phase(name, unit, total, total_bytes)
+            cls.__phases[name] = phase
+            cls.emit(phase, "start")
+
+    # For phases where the total is only known bit by bit, e.g. downloads while the file list is still being retrieved
+    @classmethod
+    def add_total(cls, name: str, total: int = 0, total_bytes: int = 0):
+        with cls.__lock:
+            phase = cls.__phases.get(name)
+            if phase is None:
+                return
+
+            phase.total = (phase.total or 0) + total
+            phase.total_bytes = (phase.total_bytes or 0) + total_bytes
+
+    # Updates for phases that haven't been started are ignored, e.g. when downloading a single file as a library
+    @classmethod
+    def update(cls, name: str, done: int = 1, num_bytes: int = 0):
+        with cls.__lock:
+            phase = cls.__phases.get(name)
+            if phase is None:
+                return
+
+            phase.done += done
+            phase.bytes += num_bytes
+
+            if time.monotonic() - phase.last_emit >= cls.INTERVAL:
+                cls.emit(phase, "progress")
+
+    @classmethod
+    def finish(cls, name: str):
+        with cls.__lock:
+            phase = cls.__phases.pop(name, None)
+            if phase is not None:
+                cls.emit(phase, "finish")
+
+    # Must be called with the lock held
+    @classmethod
+    def emit(cls, phase: Phase, event_type: str):
+        phase.last_emit = time.monotonic()
+        mode = Switches.progress_mode
+        if mode == Switches.ProgressModes.QUIET:
+            return
+
+        event = cls.build_event(phase, event_type)
+        if mode == Switches.ProgressModes.JSON:
+            sys.stderr.write(Json.dumps(event) + "\n")
+            sys.stderr.flush()
+        elif mode == Switches.ProgressModes.BAR:
+            cls.print_bar(event)
+        else:
+            print(cls.format_event(event))
+
+    @staticmethod
+    def build_event(phase: Phase, event_type: str):
+        elapsed = time.monotonic() - phase.started
+        event = {
+            'event': event_type,
+            'phase': phase.name,
+            'unit': phase.unit,
+            'done': phase.done,
+            'total': phase.total,
+            'elapsed': round(elapsed, 2),
+            'rate': round(phase.done / elapsed, 2) if elapsed > 0 else None
+        }
+
+        if phase.bytes > 0 or phase.total_bytes is not None:
+            event['bytes'] = phase.bytes
+            event['total_bytes'] = phase.total_bytes
+            event['bytes_rate'] = round(phase.bytes / elapsed) if elapsed > 0 else None
+
+        # Byte based estimates are more accurate when items vary in size (i.e. files)
+        event['eta'] = None
+        if event.get('total_bytes') and event['bytes_rate']:
+            event['eta'] = round((phase.total_bytes - phase.bytes) / event['bytes_rate'], 1)
+        elif phase.total is not None and event['rate']:
+            event['eta'] = round((phase.total - phase.done) / event['rate'], 1)
+
+        return event
+
+    @staticmethod
+    def format_event(event: dict):
+        if event['event'] == "start":
+            return f"Started {event['phase']}"
+
+        text = f"{event['phase'].capitalize()}: {event['done']}"
+        if event['total'] is not None:
+            text += f"/{event['total']}"
+        text += f" {event['unit']}"
+
+        if event['rate'] is not None:
+            text += f" ({event['rate']:.1f}/s)"
+        if event['event'] == "finish":
+            return text + f" in {event['elapsed']:.1f}s"
+        if event['eta'] is not None:
+            text += f", ETA {event['eta']:.0f}s"
+
+        return text
+
+    @classmethod
+    def print_bar(cls, event: dict):
+        text = cls.format_event(event)
+        if event['total']:
+            filled = int(cls.BAR_WIDTH * min(event['done'] / event['total'], 1))
+            text = "[" + "#" * filled + " " * (cls.BAR_WIDTH - filled) + "] " + text
+
+        end = "\n" if event['event'] == "finish" else ""
+        sys.stderr.write("\r" + text.ljust(100) + end)
+        sys.stderr.flush()
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+
+# Spaces out requests made from multiple threads so that they stay under slack's rate limits
+# https://api.slack.com/docs/rate-limits
+# Slack limits each API method separately, so slots are kept per method and the tier only decides how far apart they are
+# By default the limits only apply within this process. When exports are sharded across several processes (or hosts
+# sharing a filesystem) use_database makes every process reserve its slots from one SQLite database instead
+class RateLimiter:
+    # Requests per minute allowed for each method in a tier
+    TIER_LIMITS = {
+        1: 1,
+        2: 20,
+        3: 50,
+        4: 100
+    }
+
+    # Seconds to wait for another process to release the database
+    DATABASE_TIMEOUT = 30
+
+    __lock = threading.Lock()
+    __next_slot = {}
+    __database = None
+    __key = None
+
+    # Limits are per token, so the token (hashed) is part of the key and different tokens can share a database
+    @classmethod
+    def use_database(cls, loc: str, token: str):
+        cls.__database = loc
+        cls.__key = hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+
+        with cls.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS method_slots (key TEXT, method TEXT, next_slot REAL, "
+                         "PRIMARY KEY (key, method))")
+        conn.close()
+
+    # The method name is the last part of the URL, e.g. conversations.history
+    @staticmethod
+    def get_method(url: str):
+        return url.rsplit("/", 1)[-1]
+
+    # Blocks until a request to the method (which is in the given tier) can be made
+    @classmethod
+    def acquire(cls, method: str, tier: int):
+        now, slot = cls.reserve(method, cls.get_interval(tier), 0)
+
+        if slot > now:
+            time.sleep(slot - now)
+
+    # Pushes back every request to the method, e.g. after slack responds with a 429
+    @classmethod
+    def back_off(cls, method: str, seconds: float):
+        cls.reserve(method, 0, seconds)
+
+    @classmethod
+    def get_interval(cls, tier: int):
+        return 60 / cls.TIER_LIMITS[tier]
+
+    # Returns the current time and the reserved slot, the next slot is moved on by interval
+    # The slot is always at least min_wait seconds from now
+    @classmethod
+    def reserve(cls, method: str, interval: float, min_wait: float):
+        if cls.__database is not None:
+            return cls.reserve_shared(method, interval, min_wait)
+
+        # Reserve the next free slot while holding the lock, but sleep without it so other methods aren't held up
+        with cls.__lock:
+            now = time.monotonic()
+            slot = max(now + min_wait, cls.__next_slot.get(method, now))
+            cls.__next_slot[method] = slot + interval
+
+        return now, slot
+
+    # Same as the local reservation, but using wall clock time so that it's comparable between processes
+    # BEGIN IMMEDIATE takes the database write lock, so only one process can reserve a slot at a time
+    @classmethod
+    def reserve_shared(cls, method: str, interval: float, min_wait: float):
+        conn = cls.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT next_slot FROM method_slots WHERE key = ? AND method = ?",
+                               (cls.__key, method)).fetchone()
+
+            now = time.time()
+            slot = max(now + min_wait, row[0] if row is not None else now)
+            conn.execute("INSERT OR REPLACE INTO method_slots (key, method, next_slot) VALUES (?, ?, ?)",
+                         (cls.__key, method, slot + interval))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+        return now, slot
+
+    # Connections can't be shared between threads, and opening one is cheap compared to a request
+    @classmethod
+    def connect(cls):
+        return sqlite3.connect(cls.__database, timeout=cls.DATABASE_TIMEOUT, isolation_level=None)
+
+# Equivalent of RateLimiter for coroutines, which reserves its slots from RateLimiter so that threads, coroutines
+# and other processes (when using a database) all share the same limits
+# Reserving can wait on the database, so it's done in a worker thread rather than blocking the event loop
+class AsyncRateLimiter:
+    @classmethod
+    async def acquire(cls, method: str, tier: int):
+        now, slot = await asyncio.to_thread(RateLimiter.reserve, method, RateLimiter.get_interval(tier), 0)
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    @classmethod
+    async def back_off(cls, method: str, seconds: float):
+        await asyncio.to_thread(RateLimiter.back_off, method, seconds)
@@ -0,0 +1,106 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from api import Api
+from progress import Progress
+
+# Base for maps that only look up the IDs that are actually referenced, rather than crawling the whole workspace
+# Unknown IDs are looked up on first access, and lookups are cached for the lifetime of the map
+# Subclasses implement lookup(key), which returns None for IDs that slack doesn't recognise
+# Those are cached as None, so get returns the default for them like a normal dict would
+class LazyMap(dict):
+    PREFETCH_WORKERS = 8
+    DESCRIPTION = "mapping"
+
+    def __missing__(self, key):
+        value = self.lookup(key)
+        self[key] = value
+        return value
+
+    # dict.get doesn't go through __missing__, but everything that asks for an ID wants it resolved
+    def get(self, key, default=None):
+        value = self[key]
+        return default if value is None else value
+
+    # Look up all the IDs that aren't already cached concurrently, rather than one at a time during formatting
+    def prefetch(self, keys):
+        missing = [key for key in keys if key not in self]
+        if len(missing) == 0:
+            return
+
+        Progress.info(f"Retrieving {len(missing)} {self.DESCRIPTION}(s)")
+        with ThreadPoolExecutor(max_workers=self.PREFETCH_WORKERS) as executor:
+            for key, value in zip(missing, executor.map(self.lookup, missing)):
+                self[key] = value
+
+    @classmethod
+    def iter_strings(cls, obj):
+        if isinstance(obj, str):
+            yield obj
+        elif isinstance(obj, dict):
+            for value in obj.values():
+                yield from cls.iter_strings(value)
+        elif isinstance(obj, list):
+            for value in obj:
+                yield from cls.iter_strings(value)
+
+# Map of user IDs to display names
+class UserMap(LazyMap):
+    REGEX_MENTION = re.compile('<@([UW][A-Z0-9]+)')
+    DESCRIPTION = "user mapping"
+
+    @staticmethod
+    def lookup(user_id):
+        user = Api.get_user_info(user_id)
+        if user is None:
+            return None
+
+        return user['profile']['display_name']
+
+    @classmethod
+    def collect_ids(cls, items):
+        user_ids = set()
+
+        for item in items:
+            if 'user' in item:
+                user_ids.add(item['user'])
+
+            for file in item.get('files', []):
+                if 'user' in file:
+                    user_ids.add(file['user'])
+
+            for reply in item.get('replies', []):
+                if 'user' in reply:
+                    user_ids.add(reply['user'])
+
+            # Mentions can be in the text, attachments or fields, so search everything that's a string
+            for value in cls.iter_strings(item):
+                user_ids.update(cls.REGEX_MENTION.findall(value))
+
+        user_ids.discard("USLACKBOT")
+        return user_ids
+
+# Map of conversation IDs to names prefixed with # (or @ for DMs)
+class ConversationMap(LazyMap):
+    REGEX_MENTION = re.compile('<#([GC][A-Z0-9]+)')
+    DESCRIPTION = "conversation mapping"
+
+    @staticmethod
+    def lookup(conv_id):
+        conv = Api.get_conversation_info(conv_id)
+        if conv is None or 'name' not in conv:
+            return None
+
+        if conv['is_im']:
+            return "@" + conv['name']
+        return "#" + conv['name']
+
+    @classmethod
+    def collect_ids(cls, items):
+        conv_ids = set()
+
+        for item in items:
+            for value in cls.iter_strings(item):
+                conv_ids.update(cls.REGEX_MENTION.findall(value))
+
+        return conv_ids
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import math
+import os
+import os.path
+import tempfile
+import time
+
+from switches import Switches
+
+# On disk cache of API responses, keyed by the endpoint and its parameters (excluding the token)
+# RECORD uses cached responses where they exist and saves new ones, REPLAY only uses cached responses (so runs can be
+# done offline), and REFRESH always makes the request and overwrites what was cached
+class ResponseCache:
+    directory = None
+    mode = Switches.CacheModes.RECORD
+
+    EXCLUDED_PARAMS = ('token',)
+
+    # End of range parameters, when these are in the future they're rounded up to a day so that the key stays the same
+    END_PARAMS = ('latest', 'ts_to')
+    END_ROUNDING = 24 * 60 * 60
+
+    @classmethod
+    def configure(cls, directory: str, mode=Switches.CacheModes.RECORD):
+        cls.directory = directory
+        cls.mode = mode
+
+    @classmethod
+    def enabled(cls):
+        return cls.directory is not None
+
+    # Returns the cached response body, or None if it should be requested
+    @classmethod
+    def lookup(cls, url: str, params: dict):
+        if not cls.enabled() or cls.mode == Switches.CacheModes.REFRESH:
+            return None
+
+        loc = cls.get_loc(url, params)
+        if not os.path.exists(loc):
+            return None
+
+        with open(loc, "rb") as f:
+            return f.read()
+
+    @classmethod
+    def store(cls, url: str, params: dict, body: bytes):
+        if not cls.enabled() or cls.mode == Switches.CacheModes.REPLAY:
+            return
+
+        loc = cls.get_loc(url, params)
+        os.makedirs(os.path.dirname(loc), exist_ok=True)
+
+        # Threads can store the same response at once, so each one needs its own temporary file
+        fd, tmp_loc = tempfile.mkstemp(dir=os.path.dirname(loc), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(tmp_loc, loc)
+
+    @classmethod
+    def get_loc(cls, url: str, params: dict):
+        key = cls.get_key(url, params)
+        return os.path.join(cls.directory, key[:2], key + ".json")
+
+    # Parameters are compared as strings so that e.g. 1 and '1' give the same key
+    # The standard json module is used so that the key doesn't depend on which Json backend is installed
+    @classmethod
+    def get_key(cls, url: str, params: dict):
+        normalised = {key: str(cls.normalise_param(key, value)) for key, value in params.items()
+                      if key not in cls.EXCLUDED_PARAMS}
+        data = json.dumps([url, normalised], sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    # A range ending in the future covers everything up to now, wherever in the future it ends
+    @classmethod
+    def normalise_param(cls, key: str, value):
+        if key not in cls.END_PARAMS:
+            return value
+
+        end = float(value)
+        if end <= time.time():
+            return value
+        return int(math.ceil(end / cls.END_ROUNDING) * cls.END_ROUNDING)
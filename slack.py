@@ -40,27 +40,34 @@ class Slack:
         self.__last_date = None
         self.__last_user = None
         self.thread_msgs = None
+        self.__thread_children = None
         self.process_channel_threads = process_threads
 
-    def format_messages(self, messages, process_children=False):
-        self.thread_msgs = self.get_thread_msgs(messages)
+    def format_messages(self, messages, process_children=False, thread_msgs=None):
+        formatted_data = [text for _, text in self.iter_formatted(messages, process_children, thread_msgs)]
+        formatted_data = "".join(formatted_data)
+
+        return formatted_data.strip()
+
+    # Yields each message that is formatted alongside its text, so that the output can be streamed
+    # The text is not stripped, joining it all together and stripping it gives the output of format_messages
+    # Thread messages can be given when formatting part of a conversation, so that threads spanning parts are complete
+    def iter_formatted(self, messages, process_children=False, thread_msgs=None):
+        if thread_msgs is None:
+            thread_msgs = self.get_thread_msgs(messages)
+        self.thread_msgs = thread_msgs
+        self.__thread_children = None
 
         # Reset last date/user
         self.__last_date = None
         self.__last_user = None
 
-        # Build and return data
-        formatted_data = []
         for msg in messages:
             # Do not process thread child messages, they will either be processed by reply_broadcast or the parent message
             if (not ('thread_ts' in msg and msg['thread_ts'] != msg['ts']))\
                 or ('subtype' in msg and msg['subtype'] == 'thread_broadcast')\
                     or process_children:
-                formatted_data.append(self.format_message(msg))
-
-        formatted_data = "".join(formatted_data)
-
-        return formatted_data.strip()
+                yield msg, self.format_message(msg)
 
     def format_message(self, msg):
         prefix_str = "\n"
@@ -109,7 +116,7 @@ class Slack:
             body_str += file_str
 
         # If message contains replies, then add them as a thread
-        if 'thread_ts' in msg and 'replies' in msg and len(msg['replies']) > 0:
+        if 'thread_ts' in msg and len(self.get_replies(msg)) > 0:
             body_str += "\n\n" + Slack.INDENTATION_SHORT + "T: "
             body_str += self.add_thread_msgs(msg)
 
@@ -293,7 +300,7 @@ class Slack:
 
     def improve_message_text(self, msg: str, include_ampersand=True):
         msg = self.improve_user_mentions(msg, include_ampersand)
-        self.improve_channel_mentions(msg)
+        msg = self.improve_channel_mentions(msg)
 
         # Replace HTML encoded characters
         for i in Slack.SLACK_HTML_ENCODING:
@@ -318,10 +325,8 @@ class Slack:
 
             if user_id == 'SLACKBOT':
                 new_text += "Slackbot"
-            elif user_id in self.user_map:
-                new_text += self.user_map[user_id]
             else:
-                new_text += user_id
+                new_text += self.user_map.get(user_id, user_id)
 
             msg = msg.replace(match.group(), new_text)
 
@@ -342,13 +347,10 @@ class Slack:
         # Format 1, no pipe
         mentions = re.finditer('<#([GC])([^|>]+)>', msg)
         for match in mentions:
-            new_text = "#"
             conv_id = match.group()[2:-1]
 
-            if conv_id in self.conv_map:
-                new_text += self.conv_map[conv_id]
-            else:
-                new_text += conv_id
+            # Names in the map already include the # prefix
+            new_text = self.conv_map.get(conv_id, "#" + conv_id)
 
             msg = msg.replace(match.group(), new_text)
 
@@ -373,17 +375,36 @@ class Slack:
             if username == "USLACKBOT":
                 return 'Slackbot'
             else:
-                return user_map[username]
+                # Fall back to the ID for users that couldn't be resolved (e.g. deleted users)
+                return user_map.get(username, username)
 
         if 'username' in msg:
             return msg['username']
 
         return "Unknown"
 
+    # Older history responses list the replies of each parent, but recent ones only give reply_count
+    # So if the replies aren't listed then they're found in the thread messages instead
+    def get_replies(self, parent):
+        if 'replies' in parent:
+            return parent['replies']
+        if parent.get('reply_count', 0) == 0 or parent.get('thread_ts') != parent['ts'] or self.thread_msgs is None:
+            return []
+
+        if self.__thread_children is None:
+            self.__thread_children = {}
+            for child in self.thread_msgs.values():
+                self.__thread_children.setdefault(child['thread_ts'], []).append({'user': child.get('user'),
+                                                                                  'ts': child['ts']})
+            for children in self.__thread_children.values():
+                children.sort(key=lambda child: float(child['ts']))
+
+        return self.__thread_children.get(parent['ts'], [])
+
     def add_thread_msgs(self, parent):
         # Combine messages into array
         thread = []
-        for child in parent['replies']:
+        for child in self.get_replies(parent):
             child_ts = child['ts']
 
             if child_ts not in self.thread_msgs:
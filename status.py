@@ -1,6 +1,10 @@
 # Class to store list of warnings/errors encountered during execution
+import threading
 
 class Status:
+    # Held when updating counts from multiple threads
+    lock = threading.Lock()
+
     # Stats
     tot_files = 0
     files_already_exist = 0
@@ -13,6 +17,16 @@ class Status:
     # Warnings
     thread_msgs_not_found = 0
 
+    # Clear everything, so that the counts for one run don't carry over to the next
+    @classmethod
+    def reset(cls):
+        cls.tot_files = 0
+        cls.files_already_exist = 0
+        cls.export_json = False
+        cls.export_text = False
+        cls.file_failures = 0
+        cls.thread_msgs_not_found = 0
+
     @classmethod
     def num_errors(cls):
 
@@ -1,6 +1,8 @@
 from enum import Enum
 import argparse
 import datetime
+import importlib.util
+import re
 
 class Switches:
     # region Switch definitions
@@ -9,9 +11,48 @@ class Switches:
         UK = '%d/%m/%Y'
     date_mode = DateModes.ISO8601
     date_start = datetime.datetime(2000, 1, 1)
-    date_end = datetime.datetime.today() + datetime.timedelta(days=1)
+    # Midnight at the end of today, rather than the current time, so that reruns on the same day cover the same range
+    date_end = datetime.datetime.combine(datetime.date.today(), datetime.time()) + datetime.timedelta(days=1)
+
+    class Compression(Enum):
+        NONE = ''
+        GZIP = '.gz'
+        ZSTD = '.zst'
+    json_compression = Compression.NONE
+    json_indent = 4
+    text_compression = Compression.NONE
+    text_index = False
+
+    class Periods(Enum):
+        DAY = '%Y-%m-%d'
+        MONTH = '%Y-%m'
+        YEAR = '%Y'
+    rotate_size = None
+    rotate_period = None
+    partition = None
+
+    class ProgressModes(Enum):
+        TEXT = 'text'
+        JSON = 'json'
+        BAR = 'bar'
+        QUIET = 'quiet'
+    progress_mode = ProgressModes.TEXT
+
+    class CacheModes(Enum):
+        RECORD = 'record'
+        REPLAY = 'replay'
+        REFRESH = 'refresh'
+    cache_mode = CacheModes.RECORD
+
+    filter_users = set()
+    exclude_subtypes = set()
+    exclude_bots = False
+    file_types = set()
+    file_max_size = None
     # endregion
 
+    SIZE_MULTIPLIERS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
     # Set using arguments
     @classmethod
     def set_switches(cls, args: argparse.Namespace, parser: argparse.ArgumentParser):
@@ -26,6 +67,66 @@ class Switches:
         if cls.date_start > cls.date_end:
             parser.error("Start date must be before end date")
 
+        if args.progress is not None:
+            cls.progress_mode = cls.convert_enum(cls.ProgressModes, args.progress, "progress mode", parser)
+
+        # Filters
+        if args.filter_user is not None:
+            cls.filter_users = set(args.filter_user)
+        if args.exclude_subtype is not None:
+            cls.exclude_subtypes = set(args.exclude_subtype)
+        cls.exclude_bots = args.exclude_bots
+        if args.file_type is not None:
+            cls.file_types = {file_type.lower() for file_type in args.file_type}
+        if args.file_max_size is not None:
+            cls.file_max_size = cls.convert_size(args.file_max_size, parser)
+
+        if args.cache_mode is not None:
+            cls.cache_mode = cls.convert_enum(cls.CacheModes, args.cache_mode, "cache mode", parser)
+
+        if args.file_workers < 1:
+            parser.error("Number of file workers must be at least 1")
+
+        # Output
+        if args.json_indent is not None:
+            if args.json_indent < 1:
+                parser.error("JSON indent must be at least 1")
+            cls.json_indent = args.json_indent
+        if args.json_compression is not None:
+            cls.json_compression = cls.convert_enum(cls.Compression, args.json_compression, "json compression", parser)
+        if args.text_compression is not None:
+            cls.text_compression = cls.convert_enum(cls.Compression, args.text_compression, "text compression", parser)
+        if cls.Compression.ZSTD in (cls.json_compression, cls.text_compression) \
+                and importlib.util.find_spec('zstandard') is None:
+            parser.error("zstd compression requires the zstandard package to be installed")
+
+        cls.text_index = args.text_index
+        if cls.text_index and args.text is None:
+            parser.error("Text output is required to index it")
+
+        if args.rotate_size is not None:
+            cls.rotate_size = cls.convert_size(args.rotate_size, parser)
+        if args.rotate_period is not None:
+            cls.rotate_period = cls.convert_enum(cls.Periods, args.rotate_period, "rotation period", parser)
+        if args.partition is not None:
+            cls.partition = cls.convert_enum(cls.Periods, args.partition, "partition period", parser)
+
+            if cls.rotate_size is not None or cls.rotate_period is not None:
+                parser.error("Output can't be rotated when it is partitioned")
+            # Existing partitions are merged using their json, without it a partial run would overwrite the text
+            if args.json is None:
+                parser.error("Partitioned output requires json output, as it is used to merge existing partitions")
+
+        # Only retrieve the most recent messages, and patch them into the archive
+        if args.refresh_window is not None:
+            if cls.partition is None or args.json is None:
+                parser.error("Refreshing a window requires partitioned json output to compare against")
+            if args.refresh_window < 1:
+                parser.error("Refresh window must be at least 1 day")
+
+            window_start = datetime.datetime.now() - datetime.timedelta(days=args.refresh_window)
+            cls.date_start = max(cls.date_start, window_start)
+
     # Handle date parsing
     @classmethod
     def convert_date(cls, date_str: str, arg_parser: argparse.ArgumentParser):
@@ -34,6 +135,15 @@ class Switches:
         except ValueError as e:
             arg_parser.error(e)
 
+    # Handle sizes such as 500KB or 2GB
+    @classmethod
+    def convert_size(cls, size_str: str, arg_parser: argparse.ArgumentParser):
+        match = re.fullmatch('([0-9]+)\\s*([KMG]?)B?', size_str.strip().upper())
+        if match is None or int(match.group(1)) == 0:
+            arg_parser.error("Could not interpret size '" + size_str + "'. Use a number optionally followed by KB, MB or GB")
+
+        return int(match.group(1)) * cls.SIZE_MULTIPLIERS[match.group(2)]
+
     # Handle parsing switches properly
     @classmethod
     def convert_enum(cls, enum, string: str, switch_str: str, arg_parser: argparse.ArgumentParser):
@@ -0,0 +1,58 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from api import Api
+from filters import Filters
+from progress import Progress
+from slack import Slack
+
+# Retrieves thread replies that weren't in the retrieved history (e.g. replies made after the end date)
+# Only the threads with missing replies are requested, concurrently and through the rate limiter
+# Replies are cached for the lifetime of the process, so repeated runs (e.g. a daemon) don't request them again
+# unless the parent shows that the thread has new replies since they were retrieved
+class ThreadBackfill:
+    WORKERS = 4
+
+    __cache = {}
+
+    def __init__(self, conv: str):
+        self.conv = conv
+
+    # Returns the thread messages (keyed by ts) for the conversation, including any that were missing
+    def backfill(self, messages):
+        thread_msgs = Slack.get_thread_msgs(messages)
+        missing = self.find_missing(messages, thread_msgs)
+        if len(missing) == 0:
+            return thread_msgs
+
+        Progress.info(f"Retrieving replies for {len(missing)} thread(s) with missing messages")
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            for replies in executor.map(self.get_replies, missing):
+                thread_msgs.update(Slack.get_thread_msgs(replies))
+
+        return thread_msgs
+
+    # Recent history responses don't list the replies, so threads are also missing replies if there are fewer
+    # than reply_count of them. The formatter finds the replies in the thread messages if they aren't listed
+    @staticmethod
+    def find_missing(messages, thread_msgs: dict):
+        missing = []
+        num_found = collections.Counter(child['thread_ts'] for child in thread_msgs.values())
+
+        for msg in messages:
+            if 'thread_ts' not in msg or msg['thread_ts'] != msg['ts']:
+                continue
+
+            if any(child['ts'] not in thread_msgs for child in msg.get('replies', [])) \
+                    or num_found[msg['ts']] < msg.get('reply_count', 0):
+                missing.append(msg)
+
+        return missing
+
+    def get_replies(self, parent: dict):
+        key = (self.conv, parent['ts'])
+        version = (parent.get('reply_count'), parent.get('latest_reply'))
+        if key not in self.__cache or self.__cache[key][0] != version:
+            self.__cache[key] = version, Filters.filter_messages(Api.get_replies(self.conv, parent['ts']))
+
+        return self.__cache[key][1]
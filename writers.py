@@ -0,0 +1,262 @@
+import datetime
+import glob
+import gzip
+import os
+import os.path
+import re
+
+from files import Files
+from json_backend import Json
+from progress import Progress
+from switches import Switches
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Streams records to disk, optionally compressing them and splitting the output into segments
+# Segments are started when the current one exceeds the size limit (uncompressed), or when a record belongs to a new period
+class SegmentWriter:
+    HEADER = ""
+    FOOTER = ""
+    SEPARATOR = ""
+
+    def __init__(self, loc: str, compression=Switches.Compression.NONE, max_bytes: int = None, period=None):
+        self.loc = loc
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.period = period
+        self.segments = []
+
+        self.__file = None
+        self.__period_key = None
+        self.__index = 0
+        self.bytes_written = 0
+        self.records_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        if exc_type is None:
+            self.remove_stale_segments()
+
+    def write_record(self, text: str, ts: str = None):
+        if self.__file is not None and self.needs_rotation(ts):
+            self.close()
+
+        if self.__file is None:
+            self.open_segment(ts)
+        elif self.records_written > 0:
+            self.write(self.SEPARATOR)
+
+        self.write_text(text)
+        self.records_written += 1
+
+    def needs_rotation(self, ts: str):
+        if self.max_bytes is not None and self.bytes_written >= self.max_bytes:
+            return True
+        if self.period is not None and ts is not None and self.get_period_key(ts) != self.__period_key:
+            return True
+        return False
+
+    def open_segment(self, ts: str = None):
+        if self.period is not None and ts is not None:
+            self.__period_key = self.get_period_key(ts)
+        self.__index += 1
+
+        loc = self.segment_loc()
+        Files.make_dirs(loc)
+        Progress.info(f"Saving data to {loc}")
+
+        self.__file = self.open_stream(loc, self.compression)
+
+        self.segments.append(loc)
+        self.bytes_written = 0
+        self.records_written = 0
+        self.write(self.HEADER)
+
+    @staticmethod
+    def open_stream(loc: str, compression):
+        if compression == Switches.Compression.GZIP:
+            return gzip.open(loc, "wb")
+        if compression == Switches.Compression.ZSTD:
+            return zstandard.ZstdCompressor().stream_writer(open(loc, "wb"), closefd=True)
+        return open(loc, "wb")
+
+    @staticmethod
+    def read_stream(loc: str, compression):
+        if compression == Switches.Compression.GZIP:
+            with gzip.open(loc, "rb") as f:
+                return f.read()
+        if compression == Switches.Compression.ZSTD:
+            with open(loc, "rb") as f:
+                return zstandard.ZstdDecompressor().stream_reader(f).read()
+        with open(loc, "rb") as f:
+            return f.read()
+
+    def close(self):
+        if self.__file is None:
+            return
+
+        self.finish_segment()
+        self.__file.close()
+        self.__file = None
+
+    # Makes sure that there's always an output, even when there's nothing to write
+    def close_or_empty(self):
+        if self.__file is None and len(self.segments) == 0:
+            self.open_segment()
+        self.close()
+
+    def finish_segment(self):
+        self.write(self.FOOTER)
+
+    # Hook for subclasses that need to process the text before it's written
+    def write_text(self, text: str):
+        self.write(text)
+
+    def write(self, text: str):
+        data = text.encode('utf-8')
+        self.__file.write(data)
+        self.bytes_written += len(data)
+
+    # A previous run that wrote more segments leaves the higher numbered ones behind, which would duplicate messages
+    def remove_stale_segments(self):
+        if self.max_bytes is None:
+            return
+
+        base, ext = os.path.splitext(self.loc)
+        regex = re.compile(re.escape(base) + r"(\.[^.]+)?\.([0-9]{4})" + re.escape(ext + self.compression.value))
+        for loc in sorted(glob.glob(glob.escape(base) + ".*" + glob.escape(ext + self.compression.value))):
+            match = regex.fullmatch(loc)
+            if match is None or int(match.group(2)) <= self.__index or loc in self.segments:
+                continue
+
+            Progress.info(f"Removing {loc} left over from a previous run")
+            os.remove(loc)
+            if os.path.exists(loc + TextIndex.EXT):
+                os.remove(loc + TextIndex.EXT)
+
+    def segment_loc(self):
+        base, ext = os.path.splitext(self.loc)
+
+        # Segments are only numbered when rotating by size, the numbers carry on across periods rather than restarting
+        parts = [base]
+        if self.period is not None and self.__period_key is not None:
+            parts.append(self.__period_key)
+        if self.max_bytes is not None:
+            parts.append(str(self.__index).rjust(4, '0'))
+
+        return ".".join(parts) + ext + self.compression.value
+
+    def get_period_key(self, ts: str):
+        return datetime.datetime.fromtimestamp(float(ts)).strftime(self.period.value)
+
+# Writes messages as a JSON array, identical to Json.dumps(messages, Switches.json_indent) when there is only one segment
+class JsonWriter(SegmentWriter):
+    HEADER = "["
+    FOOTER = "\n]"
+    SEPARATOR = ",\n"
+
+    def write_message(self, msg: dict):
+        indent = " " * Switches.json_indent
+        text = indent + Json.dumps(msg, Switches.json_indent).replace("\n", "\n" + indent)
+        self.write_record(text, msg.get('ts'))
+
+    def write_text(self, text: str):
+        if self.records_written == 0:
+            self.write("\n")
+        self.write(text)
+
+    def finish_segment(self):
+        # Match Json.dumps for empty lists
+        if self.records_written == 0:
+            self.write("]")
+        else:
+            self.write(self.FOOTER)
+
+# Maps each day header and message in a text transcript to its byte offset, so readers can seek straight to them
+# Offsets are into the uncompressed text, the index is saved next to the transcript with EXT appended to its name
+class TextIndex:
+    EXT = ".index.json"
+
+    def __init__(self):
+        self.days = []
+        self.messages = []
+        self.__last_date = None
+
+    # Takes the formatted text of a message and the offset of where it starts
+    def add(self, ts: str, text: str, offset: int):
+        body = text.lstrip("\n")
+        if body.strip() == "":
+            return
+        offset += len(text) - len(body)
+
+        date = datetime.datetime.fromtimestamp(float(ts)).date()
+        if date != self.__last_date:
+            self.__last_date = date
+            self.days.append([date.isoformat(), offset])
+
+            # Point the message at the line after the day header, if it has one
+            header = "-- " + date.strftime(Switches.date_mode.value) + " --"
+            header_end = body.find(header)
+            if header_end != -1 and body[:header_end].strip() == "":
+                rest = body[header_end + len(header):]
+                msg_start = len(body) - len(rest.lstrip(" ").lstrip("\n"))
+                offset += len(body[:msg_start].encode('utf-8'))
+
+        self.messages.append([ts, offset])
+
+    def dumps_bytes(self, file_name: str):
+        return Json.dumps_bytes({'file': file_name, 'days': self.days, 'messages': self.messages})
+
+    def save(self, loc: str):
+        with open(loc + self.EXT, "wb") as f:
+            f.write(self.dumps_bytes(os.path.basename(loc)))
+
+# Writes the output of Slack.iter_formatted, identical to Slack.format_messages when there is only one segment
+# Leading and trailing whitespace is stripped from each segment, so trailing whitespace is held back until more text arrives
+# If indexed, a TextIndex is saved alongside each segment
+class TextWriter(SegmentWriter):
+    def __init__(self, *args, index: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__pending = ""
+        self.__ts = None
+        self.indexed = index
+        self.index = None
+
+    def write_message(self, msg: dict, text: str):
+        self.__ts = msg['ts']
+        self.write_record(text, msg['ts'])
+
+    def open_segment(self, ts: str = None):
+        if self.indexed:
+            self.index = TextIndex()
+        super().open_segment(ts)
+
+    def write_text(self, text: str):
+        if self.records_written == 0:
+            text = text.lstrip()
+
+        stripped = text.rstrip()
+        if stripped == "":
+            self.__pending += text
+            return
+
+        if self.index is not None:
+            self.index.add(self.__ts, text, self.bytes_written + len(self.__pending.encode('utf-8')))
+
+        self.write(self.__pending + stripped)
+        self.__pending = text[len(stripped):]
+
+    def finish_segment(self):
+        self.__pending = ""
+        if self.index is not None:
+            self.index.save(self.segments[-1])
+            self.index = None
+        elif os.path.exists(self.segments[-1] + TextIndex.EXT):
+            # The offsets in an old index no longer match the content
+            os.remove(self.segments[-1] + TextIndex.EXT)